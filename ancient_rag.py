@@ -1,109 +1,107 @@
 import sys
+import time
+import asyncio
 import threading
+import contextlib
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 from typing import Literal, Annotated, Sequence, Optional
-from langchain_core.messages import BaseMessage, ToolMessage
+from langchain_core.messages import AIMessage, BaseMessage, RemoveMessage
 from langgraph.graph.message import add_messages
 from langchain_core.prompts import ChatPromptTemplate
-from langgraph.store.base import BaseStore 
 from langchain_core.runnables import RunnableConfig
+from langchain_core.callbacks import get_usage_metadata_callback
 from html import escape
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import uuid
-from psycopg_pool import ConnectionPool
-from langgraph.checkpoint.postgres import PostgresSaver
-from langgraph.store.postgres import PostgresStore
+from functools import lru_cache, partial, wraps
+from psycopg_pool import AsyncConnectionPool
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.store.postgres.aio import AsyncPostgresStore
 from langgraph.graph import StateGraph, END, START
-from langgraph.prebuilt import tools_condition, ToolNode
-import threading
-import time
+from langgraph.config import get_stream_writer
+from langgraph.prebuilt import tools_condition
 from psycopg import OperationalError
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from psycopg_pool import ConnectionPool
 from config import Config
 from utils.tools import ToolConfig
+from utils.embed_cache import CachedEmbeddings
+from utils.grader import RelevanceGrader
+from utils.router import FastRouter, tool_call
+from utils.tool_executor import ToolExecutor, get_tool_executor
+from utils.user_profile import UserProfileCache
+from utils.context_budget import compact_history, estimate_tokens, render_history, stale_messages, token_report
+from utils.metrics import (
+    CHECKPOINT_OPERATIONS, DB_RETRIES, STORE_OPERATIONS, current_node, instrument_db, observe_node, record_llm_usage
+)
 from utils.log import Logger
 
 logger = Logger()
 
+# 快速路由标签对应的工具
+ROUTE_TOOLS = {"retrieve": "retriever_tool", "web": "my_web_search1"}
+# 每轮结束前压缩会话状态的节点
+COMPACT_NODE = "compact"
+# 检查点持久化模式：sync 每步写完再执行下一步，async 写入与下一步并发，exit 只在图结束时写一次
+DURABILITY_MODES = ("sync", "async", "exit")
+
 class ConnectionPoolError(Exception):
     """自定义异常，表示数据库连接池初始化或状态异常"""
     pass
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10), retry=retry_if_exception_type(OperationalError))
-def test_connection(conn_pool: ConnectionPool) -> bool:
-    with conn_pool.getconn() as conn: 
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1")
-            result = cur.fetchone()
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10), retry=retry_if_exception_type(OperationalError),
+       before_sleep=lambda _: DB_RETRIES.labels(operation="test_connection").inc())
+async def test_connection(conn_pool: AsyncConnectionPool) -> bool:
+    async with conn_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT 1")
+            result = await cur.fetchone()
             if result != (1,):
                 raise ConnectionPoolError("数据库连接池状态异常")
     return True
 
-def monitor_connection(conn_pool: ConnectionPool, interval: int = 60):
 
-    def _monitor():
-        while not conn_pool.closed:
-            try:
-                stats = conn_pool.get_stats()
-                total = stats.get('pool_size', 0)
-                available = stats.get('pool_available', 0)
-                active = total - available
-                max_size = conn_pool.max_size
-                logger.info(f"数据库连接池状态: 总数: {total}, 可用: {available}, 活动: {active}")
-                if active > max_size * 0.8:
-                    logger.warning(f"数据库连接池活动连接数过高: {active} / {max_size}")
-                    
-            except Exception as e:
-                logger.error(f"数据库连接池异常: {e}")
+class PooledPostgresSaver(AsyncPostgresSaver):
+    """连接池上的检查点存储。
 
-            time.sleep(interval)
+    父类用一把进程级 asyncio.Lock 串行化全部读写，这是为共享单连接准备的；
+    传入连接池时每次操作各自取连接，去掉这把锁后并发请求的检查点读写不再互相排队。
+    aput / aput_writes 仍按父类实现在 pipeline 模式下执行，同一次写入的多条语句共用往返。
+    """
 
-    monitor_thread = threading.Thread(target=_monitor, daemon=True)
-    monitor_thread.start()
-    return monitor_thread
+    def __init__(self, conn, *args, **kwargs):
+        super().__init__(conn, *args, **kwargs)
+        if isinstance(conn, AsyncConnectionPool):
+            self.lock = contextlib.nullcontext()
 
+@lru_cache(maxsize=1)
+def checkpoint_durability() -> str:
+    durability = Config.CHECKPOINT_DURABILITY.lower()
+    if durability not in DURABILITY_MODES:
+        logger.warning(f"未知的检查点持久化模式 {Config.CHECKPOINT_DURABILITY}，使用 async")
+        return "async"
+    return durability
 
 # 定义消息状态类，使用TypedDict进行类型注解
 class MessagesState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
     relevance_score: Annotated[Optional[str], "Relevance score of retrieved documents, 'yes' or 'no'"]
     rewrite_count: Annotated[int, "Number of times query has been rewritten"]
+    deadline: Annotated[Optional[float], "Unix timestamp after which the request falls through to generate"]
+    token_budget: Annotated[Optional[int], "Tokens left for this request, None means unlimited"]
 
 # 定义文档相关度分数类，使用Pydantic进行类型注解
 class DocumentRelevanceScore(BaseModel):
     binary_score: str = Field(description="Relevance score 'yes' or 'no'")
 
-# 重定义ToolNode，支持并发处理工具调用
-class ParallelToolNode(ToolNode):
-    def __init__(self, tools, max_workers: int=5):
-        super().__init__(tools)
-        self.max_workers = max_workers
+# 并发处理同一步中的全部工具调用。
+# 不继承 ToolNode：ToolNode 作为 Runnable 执行时不会调用 __call__，这里直接作为异步节点注册
+class ParallelToolNode:
+    def __init__(self, tools, executor: ToolExecutor = None):
+        self.tools = tools
+        self.tool_map = {tool.name: tool for tool in tools}
+        # 工具在进程级共享的执行器中运行，不再每一步新建线程池
+        self.executor = executor or get_tool_executor()
 
-    def _run_single_tool(self, tool_call: dict, tool_map: dict) -> ToolMessage:
-        try:
-            tool_name = tool_call["name"]
-            tool = tool_map.get(tool_name)
-            if not tool:
-                raise ValueError(f"Tool '{tool_name}' not found")
-
-            result = tool.invoke(tool_call["args"])
-            return ToolMessage(
-                content=str(result),
-                tool_call_id=tool_call["id"],
-                name=tool_name
-            )
-        
-        except Exception as e:
-            logger.error(f"调用工具时发生错误: {e}")
-            return ToolMessage(
-                content=f"Error: {e}",
-                tool_call_id=tool_call["id"],
-                name=tool_call.get("name", "unknown")
-            )
-        
-    def __call__(self, state: dict) -> dict:
+    async def __call__(self, state: dict) -> dict:
         logger.info(f"使用并行工具处理问题")
         last_message = state["messages"][-1]
         tool_calls = getattr(last_message, "tool_calls", [])
@@ -111,28 +109,8 @@ class ParallelToolNode(ToolNode):
         if not tool_calls:
             logger.warning("没有工具调用")
             return {"messages": []}
-        
-        tool_map = {tool.name: tool for tool in self.tools}
 
-        results = []
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_tool = {
-                executor.submit(self._run_single_tool, tool_call, tool_map): tool_call
-                for tool_call in tool_calls
-            }
-
-            for future in as_completed(future_to_tool):
-                try:
-                    result = future.result()
-                    results.append(result)
-                except Exception as e:
-                    logger.error(f"处理工具调用时发生错误: {e}")
-                    tool_call = future_to_tool[future]
-                    results.append(ToolMessage(
-                        content=f"Error: {e}",
-                        tool_call_id=tool_call["id"],
-                        name=tool_call.get("name", "unknown")
-                    ))
+        results = await self.executor.ainvoke_all(self.tool_map, tool_calls)
 
         logger.info(f"处理工具调用完成,包括{len(results)}个工具")
         return {"messages": results}
@@ -140,22 +118,28 @@ class ParallelToolNode(ToolNode):
 
 
 
-def filter_messages(messages: list) -> list:
+def filter_messages(messages: list, limit: int = 5) -> list:
     filtered = [msg for msg in messages if msg.__class__.__name__ in ["HumanMessage", "AIMessage"]]
-    return filtered[-5:] if len(filtered) > 5 else filtered
-
-def store_memory(question: BaseMessage, config: RunnableConfig, store: BaseStore) -> str:
-    namespace = ("memories", config["configurable"]["user_id"])
+    return filtered[-limit:] if len(filtered) > limit else filtered
+
+def record_context_tokens(node: str, message) -> None:
+    """记录检索内容去重、截断前后的 token 估算值（来自 retriever_tool 的 artifact）"""
+    artifact = getattr(message, "artifact", None)
+    tokens = artifact.get("context_tokens") if isinstance(artifact, dict) else None
+    if tokens:
+        token_report.record(node, tokens["before"], tokens["after"])
+
+async def store_memory(question: BaseMessage, config: RunnableConfig, profiles: UserProfileCache) -> str:
+    """返回用户画像（最近的若干条记忆，读缓存不调用嵌入接口）；用户说“记住”时交给后台队列写入"""
+    user_id = config["configurable"]["user_id"]
     try:
-        memories = store.search(namespace, query=str(question.content))
-        user_info = "\n".join([d.value["data"] for d in memories])
-
-        if "记住" in question.content.lower():
+        # 重写后再次进入 agent 时最后一条是重写结果，不重复写入
+        if question.__class__.__name__ == "HumanMessage" and "记住" in question.content.lower():
             memory = escape(question.content)
-            store.put(namespace, uuid.uuid4(), {"data": memory})
-            logger.info(f"记忆已存储: {memory}")
+            profiles.remember(user_id, memory)
+            logger.info(f"记忆已加入写入队列: {memory}")
 
-        return user_info
+        return await profiles.get(user_id)
     
     except Exception as e:
         logger.error(f"存储记忆时发生错误: {e}")
@@ -170,7 +154,6 @@ def create_chain(llm, template_file: str, structured_output=None):
         
         if template_file in create_chain.prompt_cache:
             prompt = create_chain.prompt_cache[template_file]
-            logger.info(f"使用缓存的提示: {template_file}")
 
         else:
             with create_chain.lock:
@@ -194,6 +177,47 @@ def create_chain(llm, template_file: str, structured_output=None):
         logger.error(f"创建链时发生错误: {e}")
         raise
 
+def build_chains(llm, tools) -> dict:
+    """在建图时一次性构建四个节点的链，各节点直接复用，不再每次请求重新 bind_tools / with_structured_output"""
+    return {
+        "agent": create_chain(llm.bind_tools(tools), Config.PROMPT_TEMPLATE_TXT_AGENT),
+        "grade": create_chain(llm, Config.PROMPT_TEMPLATE_TXT_GRADE, DocumentRelevanceScore),
+        "rewrite": create_chain(llm, Config.PROMPT_TEMPLATE_TXT_REWRITE),
+        "generate": create_chain(llm, Config.PROMPT_TEMPLATE_TXT_GENERATE),
+    }
+
+def request_budget() -> dict:
+    """单次请求的预算，随输入写入图状态：截止时间与可用 token 数，为 0 的项不限制"""
+    return {
+        "deadline": time.time() + Config.REQUEST_TIME_BUDGET if Config.REQUEST_TIME_BUDGET > 0 else None,
+        "token_budget": Config.REQUEST_TOKEN_BUDGET if Config.REQUEST_TOKEN_BUDGET > 0 else None,
+    }
+
+def budget_exhausted(state: MessagesState) -> bool:
+    deadline = state.get("deadline")
+    token_budget = state.get("token_budget")
+    if deadline is not None and time.time() >= deadline:
+        logger.warning("请求已超过时间预算")
+        return True
+    if token_budget is not None and token_budget <= 0:
+        logger.warning("请求已用完 token 预算")
+        return True
+    return False
+
+def charge_tokens(node):
+    """统计节点内所有 LLM 调用的 token 用量，并从状态中的 token_budget 扣除"""
+    @wraps(node)
+    async def wrapper(state: MessagesState, *args, **kwargs):
+        with get_usage_metadata_callback() as usage:
+            update = await node(state, *args, **kwargs)
+        record_llm_usage(current_node.get(), usage.usage_metadata)
+        used = sum(u.get("total_tokens", 0) for u in usage.usage_metadata.values())
+        if used and state.get("token_budget") is not None and isinstance(update, dict):
+            update["token_budget"] = state["token_budget"] - used
+            logger.info(f"本节点消耗 {used} tokens，剩余预算 {update['token_budget']}")
+        return update
+    return wrapper
+
 def get_last_question(state: MessagesState) -> str:
     try:
         if not state.get("messages") or not isinstance(state["messages"], (list, tuple)) or len(state["messages"]) == 0:
@@ -211,23 +235,21 @@ def get_last_question(state: MessagesState) -> str:
         logger.error(f"获取问题时发生错误: {e}")
         return None
 
-def agent(state: MessagesState, config: RunnableConfig, store: BaseStore, llm, tool_config: ToolConfig) -> dict:
+async def agent(state: MessagesState, config: RunnableConfig, agent_chain, profiles: UserProfileCache) -> dict:
     logger.info(f"使用agent模式处理问题")
-    namespace = ("memories", config["configurable"]["user_id"])
 
     try:
         question = state["messages"][-1]
         question_text = question.content if hasattr(question, 'content') else str(question)
-        user_info = store_memory(question, config, store)
+        user_info = await store_memory(question, config, profiles)
 
-        history_messages = filter_messages(state["messages"])
-        messages = "\n".join([f"{'用户' if m.type=='human' else '助手'}: {m.content}" for m in history_messages])
+        # 历史对话只有最后几条原样保留，更早的压缩为摘要，静态提示在前、可变内容在后便于服务端前缀缓存
+        history_messages = filter_messages(state["messages"], Config.HISTORY_WINDOW)
+        messages = compact_history(history_messages, Config.HISTORY_KEEP_VERBATIM, Config.HISTORY_SUMMARY_CHARS)
+        fixed = estimate_tokens(question_text) + estimate_tokens(str(user_info))
+        token_report.record("agent", fixed + estimate_tokens(render_history(history_messages)), fixed + estimate_tokens(messages))
 
-
-        llm_with_tools = llm.bind_tools(tool_config.get_tools())
-        agent_chain = create_chain(llm_with_tools, Config.PROMPT_TEMPLATE_TXT_AGENT)
-
-        response = agent_chain.invoke({"question": question_text, "user_info": user_info, "messages": messages})
+        response = await agent_chain.ainvoke({"question": question_text, "user_info": user_info, "messages": messages})
 
         return {"messages": [response]}
     
@@ -235,7 +257,31 @@ def agent(state: MessagesState, config: RunnableConfig, store: BaseStore, llm, t
         logger.error(f"处理问题时发生错误: {e}")
         return {"messages": [{"role": "system", "content": "处理请求时出错"}]}
     
-def grade_documents(state: MessagesState, llm) -> dict:
+async def fast_route(state: MessagesState, router: FastRouter) -> dict:
+    """本地快速路由：明显需要检索或联网的问题直接构造工具调用，寒暄直接回复，其余交给 agent"""
+    question = get_last_question(state)
+    if not question:
+        return {}
+    try:
+        has_history = sum(m.__class__.__name__ == "HumanMessage" for m in state["messages"]) > 1
+        decision = await router.route(question, has_history)
+    except Exception as e:
+        logger.error(f"快速路由时发生错误，交给agent处理: {e}")
+        return {}
+
+    if decision.label == "chat":
+        return {"messages": [AIMessage(content=decision.reply)]}
+    if decision.label in ROUTE_TOOLS:
+        return {"messages": [AIMessage(content="", tool_calls=[tool_call(ROUTE_TOOLS[decision.label], question)])]}
+    return {}
+
+def route_after_fast_route(state: MessagesState) -> Literal["call_tools", "agent", "__end__"]:
+    last_message = state["messages"][-1]
+    if not isinstance(last_message, AIMessage):
+        return "agent"
+    return "call_tools" if last_message.tool_calls else END
+
+async def grade_documents(state: MessagesState, grade_chain, grader: RelevanceGrader) -> dict:
     logger.info(f"使用文档评估模式处理问题")
     if not state.get("messages"):
         logger.error("消息状态是空的")
@@ -244,13 +290,18 @@ def grade_documents(state: MessagesState, llm) -> dict:
     
     try:
         question = get_last_question(state)
-        context = state["messages"][-1].content
-
-        grade_chain = create_chain(llm, Config.PROMPT_TEMPLATE_TXT_GRADE, DocumentRelevanceScore)
+        last_message = state["messages"][-1]
+        context = last_message.content
+        # retriever_tool 通过 artifact 返回各片段的相关度
+        artifact = getattr(last_message, "artifact", None)
+        scores = artifact.get("scores") if isinstance(artifact, dict) else None
 
-        response = grade_chain.invoke({"question": question, "context": context})
+        async def llm_grade() -> str:
+            record_context_tokens("grade_documents", last_message)
+            response = await grade_chain.ainvoke({"question": question, "context": context})
+            return response.binary_score
 
-        score = response.binary_score
+        score = await grader.grade(question, context, scores, llm_grade)
         logger.info(f"文档评估结果: {score}")
 
         return {"messages": state["messages"], "relevance_score": score}
@@ -260,12 +311,75 @@ def grade_documents(state: MessagesState, llm) -> dict:
         return {"messages": [{"role": "system", "content": "评分过程中出错"}],
                 "relevance_score": None}
     
-def rewrite(state: MessagesState, llm) -> dict:
+async def grade_and_generate(state: MessagesState, grade_chain, generate_chain, grader: RelevanceGrader) -> dict:
+    """推测执行：评估与生成并发进行。
+
+    生成的 token 先缓存在节点内，评估为 yes 后经 custom 流一次性补发并继续实时输出；
+    评估为 no 时取消生成，交由 route_after_grade 进入重写。生成失败时不返回答案，回退到 generate 节点；
+    失败前已输出部分片段时先发出 reset，调用方据此丢弃已输出的部分。
+    """
+    logger.info(f"使用推测生成模式处理问题")
+    if not state.get("messages"):
+        logger.error("消息状态是空的")
+        return {"messages": [{"role": "system", "content": "没有找到有效的消息"}],
+                "relevance_score": None}
+
+    question = get_last_question(state)
+    last_message = state["messages"][-1]
+    context = last_message.content
+    artifact = getattr(last_message, "artifact", None)
+    scores = artifact.get("scores") if isinstance(artifact, dict) else None
+
+    writer = get_stream_writer()
+    chunks = []
+    released = False
+
+    async def speculate():
+        async for chunk in generate_chain.astream({"question": question, "context": context}):
+            chunks.append(chunk.content)
+            if released:
+                writer({"type": "token", "content": chunk.content})
+
+    async def llm_grade() -> str:
+        record_context_tokens("grade_documents", last_message)
+        response = await grade_chain.ainvoke({"question": question, "context": context})
+        return response.binary_score
+
+    record_context_tokens("generate", last_message)
+    task = asyncio.create_task(speculate())
+    try:
+        score = await grader.grade(question, context, scores, llm_grade)
+    except Exception as e:
+        logger.error(f"处理文档评估时发生错误: {e}")
+        score = None
+
+    if not isinstance(score, str) or score.lower() != "yes":
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        logger.info(f"文档评估结果: {score}，已取消推测生成（已生成 {len(chunks)} 个片段）")
+        return {"relevance_score": score}
+
+    # 补发与置位之间没有 await，speculate 不会在两者之间追加新片段
+    for content in chunks:
+        writer({"type": "token", "content": content})
+    released = True
+
+    try:
+        await task
+    except Exception as e:
+        logger.error(f"推测生成时发生错误，回退到生成节点: {e}")
+        if chunks:
+            writer({"type": "reset"})
+        return {"relevance_score": score}
+
+    logger.info(f"文档评估结果: {score}，采用推测生成的回答")
+    return {"messages": [AIMessage(content="".join(chunks))], "relevance_score": score}
+
+async def rewrite(state: MessagesState, rewrite_chain) -> dict:
     logger.info(f"使用重写模式处理问题")
     try:
         question = get_last_question(state)
-        rewrite_chain = create_chain(llm, Config.PROMPT_TEMPLATE_TXT_REWRITE)
-        response = rewrite_chain.invoke({"question": question})
+        response = await rewrite_chain.ainvoke({"question": question})
 
         rewrite_count = state.get("rewrite_count", 0) + 1
         return {"messages": [response], "rewrite_count": rewrite_count}
@@ -274,14 +388,14 @@ def rewrite(state: MessagesState, llm) -> dict:
         logger.error(f"处理重写时发生错误: {e}")
         return {"messages": [{"role": "system", "content": "重写过程中出错"}]}
     
-def generate(state: MessagesState, llm) -> dict:
+async def generate(state: MessagesState, generate_chain) -> dict:
     logger.info(f"使用生成模式处理问题")
     try:
         question = get_last_question(state)
         context = state["messages"][-1].content
+        record_context_tokens("generate", state["messages"][-1])
 
-        generate_chain = create_chain(llm, Config.PROMPT_TEMPLATE_TXT_GENERATE)
-        response = generate_chain.invoke({"question": question, "context": context})
+        response = await generate_chain.ainvoke({"question": question, "context": context})
 
         return {"messages": [response]}
     
@@ -289,6 +403,14 @@ def generate(state: MessagesState, llm) -> dict:
         logger.error(f"处理生成时发生错误: {e}")
         return {"messages": [{"role": "system", "content": "生成过程中出错"}]}
 
+async def compact_state(state: MessagesState) -> dict:
+    """每轮结束时删除中间消息与窗口外的历史，检查点中的消息数不再随对话轮数增长"""
+    stale = stale_messages(state.get("messages") or [], Config.STATE_MAX_MESSAGES)
+    if not stale:
+        return {}
+    logger.info(f"压缩会话状态: 删除 {len(stale)} 条消息，保留 {len(state['messages']) - len(stale)} 条")
+    return {"messages": [RemoveMessage(id=m.id) for m in stale]}
+
 def route_after_tools(state: MessagesState, tool_config: ToolConfig) -> Literal["generate", "grade_documents"]:
     if not state.get("messages") or not isinstance(state["messages"], list):
         logger.error("消息状态是空的,自动跳转为生成模式")
@@ -308,48 +430,59 @@ def route_after_tools(state: MessagesState, tool_config: ToolConfig) -> Literal[
 
         target = tool_config.get_tool_routing_config().get(tool_name, "generate")
         logger.info(f"工具 {tool_name} 匹配到目标模式 {target}")
+        if target == "grade_documents" and budget_exhausted(state):
+            logger.info("请求预算已用完,跳过文档评估直接生成")
+            return "generate"
         return target
     
     except Exception as e:
         logger.error(f"处理工具匹配时发生错误: {e}, 自动跳转为生成模式")
         return "generate"
         
-def route_after_grade(state: MessagesState) -> Literal["generate", "rewrite"]:
+def grade_decision(state: MessagesState) -> tuple[Literal["generate", "rewrite"], str, str]:
+    """评估之后的去向，返回 (目标节点, 日志级别, 原因)；route_after_grade 与流式进度事件共用，不写日志"""
     if not isinstance(state, dict):
-        logger.error("状态不是字典,自动跳转为重写模式")
-        return "rewrite"
+        return "rewrite", "error", "状态不是字典,自动跳转为重写模式"
     
     if not state["messages"]:
-        logger.warning("消息状态是空的,自动跳转为重写模式")
-        return "rewrite"
+        return "rewrite", "warning", "消息状态是空的,自动跳转为重写模式"
     
     if "messages" not in state or not isinstance(state["messages"], (list,tuple)):
-        logger.error("状态缺失消息字段,自动跳转为重写模式")
-        return "rewrite"
+        return "rewrite", "error", "状态缺失消息字段,自动跳转为重写模式"
     
     relevance_score = state.get("relevance_score")
-    rewrite_count = state.get("rewrite_count", 0)
-    logger.info(f"文档评估结果: {relevance_score}, 重写次数: {rewrite_count}")
 
-    if rewrite_count >= 3:
-        logger.info("重写次数达到上限,自动跳转为生成模式")
-        return "generate"
+    if state.get("rewrite_count", 0) >= 3:
+        return "generate", "info", "重写次数达到上限,自动跳转为生成模式"
+
+    if budget_exhausted(state):
+        return "generate", "info", "请求预算已用完,自动跳转为生成模式"
     
     try:
         if not isinstance(relevance_score, str):
-            logger.warning("文档评估结果不是字符串,自动跳转为重写模式")
-            return "rewrite"
+            return "rewrite", "warning", "文档评估结果不是字符串,自动跳转为重写模式"
         
         if relevance_score.lower() == "yes":
-            logger.info("文档评估结果为 'yes', 自动跳转为生成模式")
-            return "generate"
+            return "generate", "info", "文档评估结果为 'yes', 自动跳转为生成模式"
 
-        logger.info("文档评估结果为 'no'或其他值, 自动跳转为重写模式")
-        return "rewrite"
+        return "rewrite", "info", "文档评估结果为 'no'或其他值, 自动跳转为重写模式"
     except Exception as e:
-        logger.error(f"处理文档评估结果时发生错误: {e}, 自动跳转为重写模式")
-        return "rewrite"
+        return "rewrite", "error", f"处理文档评估结果时发生错误: {e}, 自动跳转为重写模式"
+
+def route_after_grade(state: MessagesState) -> Literal["generate", "rewrite"]:
+    if isinstance(state, dict):
+        logger.info(f"文档评估结果: {state.get('relevance_score')}, 重写次数: {state.get('rewrite_count', 0)}")
+    target, level, reason = grade_decision(state)
+    getattr(logger, level)(reason)
+    return target
     
+def route_after_speculative_grade(state: MessagesState) -> Literal["generate", "rewrite", "__end__"]:
+    # 推测生成已产出回答时直接结束，否则与普通评估节点一致
+    messages = state.get("messages") if isinstance(state, dict) else None
+    if messages and isinstance(messages[-1], AIMessage) and not messages[-1].tool_calls:
+        return END
+    return route_after_grade(state)
+
 def save_graph_visualization(graph: StateGraph, filename: str = "graph.png") -> None:
     """保存状态图的可视化表示。
 
@@ -370,7 +503,40 @@ def save_graph_visualization(graph: StateGraph, filename: str = "graph.png") ->
         # 记录警告日志
         logger.warning(f"Failed to save graph visualization: {e}")
 
-def create_graph(conn_pool: ConnectionPool, llm, embed, tool_config: ToolConfig) -> StateGraph:
+def create_grader() -> RelevanceGrader:
+    return RelevanceGrader(
+        mode=Config.GRADE_MODE,
+        signal=Config.GRADE_SIGNAL,
+        threshold=Config.GRADE_THRESHOLD,
+        margin=Config.GRADE_MARGIN,
+        cross_encoder_model=Config.GRADE_CROSS_ENCODER_MODEL
+    )
+
+def create_router(embed) -> Optional[FastRouter]:
+    if not Config.FAST_ROUTER:
+        return None
+    try:
+        return FastRouter.from_files(
+            Config.FAST_ROUTER_TITLES, Config.FAST_ROUTER_EXAMPLES, embed,
+            threshold=Config.FAST_ROUTER_THRESHOLD, margin=Config.FAST_ROUTER_MARGIN
+        )
+    except Exception as e:
+        # 快速路由只是加速项，加载失败时所有问题照常经过 agent
+        logger.error(f"快速路由加载失败，已禁用: {e}")
+        return None
+
+def create_profile_cache() -> UserProfileCache:
+    return UserProfileCache(
+        maxsize=Config.MEMORY_PROFILE_CACHE_SIZE,
+        ttl=Config.MEMORY_PROFILE_TTL,
+        limit=Config.MEMORY_LIMIT,
+        batch_size=Config.MEMORY_WRITE_BATCH,
+        flush_interval=Config.MEMORY_FLUSH_INTERVAL
+    )
+
+async def create_graph(conn_pool: AsyncConnectionPool, llm, embed, tool_config: ToolConfig,
+                       grader: RelevanceGrader = None, router: FastRouter = None,
+                       profiles: UserProfileCache = None) -> StateGraph:
     # 检查连接池是否为None或未打开
     if conn_pool is None or conn_pool.closed:
         logger.error("数据库连接池已关闭")
@@ -386,7 +552,7 @@ def create_graph(conn_pool: ConnectionPool, llm, embed, tool_config: ToolConfig)
         if active >= max_size:
             logger.warning(f"数据库连接池活动连接数过高: {active} / {max_size}")
             raise ConnectionPoolError("连接池已耗尽，无可用连接")
-        if not test_connection(conn_pool):
+        if not await test_connection(conn_pool):
             raise ConnectionPoolError("数据库连接池测试失败")
         logger.info("数据池连接状态：ok， 测试成功")
     except Exception as e:
@@ -395,35 +561,75 @@ def create_graph(conn_pool: ConnectionPool, llm, embed, tool_config: ToolConfig)
     
     # 线程内持久化存储
     try:
-        checkpointer = PostgresSaver(conn_pool)
-        checkpointer.setup()
+        checkpointer = PooledPostgresSaver(conn_pool)
+        await checkpointer.setup()
+        instrument_db(checkpointer, "checkpoint", CHECKPOINT_OPERATIONS)
     except Exception as e:
         logger.error(f"检查点保存异常: {e}")
         raise ConnectionPoolError("检查点保存异常")
     
     # 跨线程持久化存储 
     try:
-        store = PostgresStore(conn_pool, index={"dims": 1024, "embed": embed})
-        store.setup()
+        store = AsyncPostgresStore(conn_pool, index={"dims": 1024, "embed": embed})
+        await store.setup()
+        instrument_db(store, "store", STORE_OPERATIONS)
     except Exception as e:
         logger.error(f"数据存储异常: {e}")
         raise ConnectionPoolError("数据存储异常")
     
     workflow = StateGraph(MessagesState)
 
-    workflow.add_node("agent", lambda state, config: agent(state, config, store=store, llm=llm,tool_config=tool_config))
-    workflow.add_node("call_tools", ParallelToolNode(tool_config.get_tools(), max_workers=5))
-    workflow.add_node("rewrite", lambda state: rewrite(state, llm=llm))
-    workflow.add_node("generate", lambda state: generate(state, llm=llm))
-    workflow.add_node("grade_documents", lambda state: grade_documents(state, llm=llm))
-
-    workflow.add_edge(START, "agent")
+    def add_node(name: str, node):
+        # 每个节点记录耗时、token 用量与重写后的再次执行，见 utils/metrics.py
+        workflow.add_node(name, observe_node(name, node))
+
+    # 节点均为协程函数，使用 partial 绑定依赖，LangGraph 会在 astream 中直接 await
+    # 调用 LLM 的节点经 charge_tokens 包装，从请求的 token 预算中扣除用量
+    chains = build_chains(llm, tool_config.get_tools())
+    # 用户画像缓存与后台记忆写入共用同一个记忆存储
+    profiles = profiles or create_profile_cache()
+    await profiles.setup(store)
+    add_node("agent", charge_tokens(partial(agent, agent_chain=chains["agent"], profiles=profiles)))
+    add_node("call_tools", ParallelToolNode(tool_config.get_tools()))
+    add_node("rewrite", charge_tokens(partial(rewrite, rewrite_chain=chains["rewrite"])))
+    add_node("generate", charge_tokens(partial(generate, generate_chain=chains["generate"])))
+    grader = grader or create_grader()
+    if Config.SPECULATIVE_GENERATE:
+        add_node("grade_documents", charge_tokens(partial(
+            grade_and_generate, grade_chain=chains["grade"], generate_chain=chains["generate"], grader=grader
+        )))
+    else:
+        add_node("grade_documents", charge_tokens(partial(grade_documents, grade_chain=chains["grade"], grader=grader)))
+
+    # 原本直接结束的分支改为先经过压缩节点
+    finish = END
+    if Config.STATE_COMPACTION:
+        add_node(COMPACT_NODE, compact_state)
+        workflow.add_edge(COMPACT_NODE, END)
+        finish = COMPACT_NODE
+
+    router = router or create_router(embed)
+    if router:
+        await router.setup()
+        add_node("fast_route", partial(fast_route, router=router))
+        workflow.add_edge(START, "fast_route")
+        workflow.add_conditional_edges(
+            "fast_route",
+            route_after_fast_route,
+            {
+                "call_tools": "call_tools",
+                "agent": "agent",
+                END: finish
+            }
+        )
+    else:
+        workflow.add_edge(START, "agent")
     workflow.add_conditional_edges(
         "agent", 
         tools_condition,
         {
             "tools": "call_tools",
-            END: END
+            END: finish
         }
     )
     workflow.add_conditional_edges(
@@ -434,20 +640,31 @@ def create_graph(conn_pool: ConnectionPool, llm, embed, tool_config: ToolConfig)
             "grade_documents": "grade_documents"
         }
     )
-    workflow.add_conditional_edges(
-        "grade_documents", 
-        route_after_grade,
-        {
-            "rewrite": "rewrite",
-            "generate": "generate"
-        }
-    )
+    if Config.SPECULATIVE_GENERATE:
+        workflow.add_conditional_edges(
+            "grade_documents",
+            route_after_speculative_grade,
+            {
+                "rewrite": "rewrite",
+                "generate": "generate",
+                END: finish
+            }
+        )
+    else:
+        workflow.add_conditional_edges(
+            "grade_documents", 
+            route_after_grade,
+            {
+                "rewrite": "rewrite",
+                "generate": "generate"
+            }
+        )
     workflow.add_edge("rewrite", "agent")
-    workflow.add_edge("generate", END)
+    workflow.add_edge("generate", finish)
 
     return workflow.compile(checkpointer=checkpointer, store=store)
 
-def graph_response(graph: StateGraph, user_input: str, config: dict, tool_config: ToolConfig) -> None:
+async def graph_response(graph: StateGraph, user_input: str, config: dict, tool_config: ToolConfig) -> None:
     """处理用户输入并输出响应，区分工具输出和大模型输出，支持多工具。
 
     Args:
@@ -457,27 +674,30 @@ def graph_response(graph: StateGraph, user_input: str, config: dict, tool_config
     """
     try:
         # 启动状态图流处理用户输入
-        events = graph.stream({"messages": [{"role": "user", "content": user_input}], "rewrite_count": 0}, config)
+        events = graph.astream({"messages": [{"role": "user", "content": user_input}], "rewrite_count": 0, **request_budget()}, config,
+                               durability=checkpoint_durability())
         # 遍历事件流
-        for event in events:
+        async for event in events:
             # 遍历事件中的值
             for value in event.values():
-                # 检查是否有有效消息
-                if "messages" not in value or not isinstance(value["messages"], list):
+                # 检查是否有有效消息（快速路由交给 agent 时节点没有输出）
+                if not isinstance(value, dict) or not isinstance(value.get("messages"), list):
                     logger.warning("No valid messages in response")
                     continue
 
-                # 获取最后一条消息
+                # 获取最后一条消息，压缩节点只输出删除标记
                 last_message = value["messages"][-1]
+                if isinstance(last_message, RemoveMessage):
+                    continue
 
                 # 检查消息是否包含工具调用
                 if hasattr(last_message, "tool_calls") and last_message.tool_calls:
                     # 遍历工具调用
-                    for tool_call in last_message.tool_calls:
+                    for call in last_message.tool_calls:
                         # 检查工具调用是否为字典且包含名称
-                        if isinstance(tool_call, dict) and "name" in tool_call:
+                        if isinstance(call, dict) and "name" in call:
                             # 记录工具调用日志
-                            logger.info(f"Calling tool: {tool_call['name']}")
+                            logger.info(f"Calling tool: {call['name']}")
                     # 跳过本次循环
                     continue
 
@@ -503,10 +723,19 @@ def graph_response(graph: StateGraph, user_input: str, config: dict, tool_config
         logger.error(f"Error processing response: {e}")
         print("Assistant: 处理响应时发生未知错误")
 
-def main():
+async def main():
     conn_pool = None
+    profiles = None
     try:
-        llm, embed = Config.llm1, Config.embed1
+        llm = Config.llm1
+        # FAISS 检索与 PostgresStore 记忆共用同一个嵌入缓存
+        embed = CachedEmbeddings(
+            Config.embed1,
+            maxsize=Config.EMBED_CACHE_SIZE,
+            ttl=Config.EMBED_CACHE_TTL,
+            persist_path=Config.EMBED_CACHE_PATH or None,
+            persist_max_rows=Config.EMBED_CACHE_DISK_ROWS
+        )
         tool_config = ToolConfig(embed=embed, llm=Config.llm2)
 
         connection_kwargs = {
@@ -515,25 +744,30 @@ def main():
             "connect_timeout": 5
         }
 
-        conn_pool = ConnectionPool(
+        conn_pool = AsyncConnectionPool(
             conninfo=Config.DB_URI,
             max_size=20,
             min_size=2,
             kwargs=connection_kwargs,
-            timeout=10
+            timeout=10,
+            open=False
         )
         try:
-            conn_pool.open()
+            await conn_pool.open()
             logger.info("数据库连接池已打开")
             logger.debug("数据库连接池已打开")
         except Exception as e:
             logger.error(f"数据库连接池打开失败: {e}")
             raise ConnectionPoolError("数据库连接池打开失败")
-        
-        monitor_thread = monitor_connection(conn_pool, interval=60)
 
         try:
-            graph = create_graph(conn_pool, llm, embed, tool_config)
+            await tool_config.search_cache.setup(conn_pool)
+        except Exception as e:
+            logger.error(f"搜索缓存初始化失败，仅在进程内合并相同搜索: {e}")
+
+        try:
+            profiles = create_profile_cache()
+            graph = await create_graph(conn_pool, llm, embed, tool_config, profiles=profiles)
         except Exception as e:
             logger.error(f"创建图失败: {e}")
             print("错误: 创建图失败")
@@ -548,7 +782,7 @@ def main():
         # 进入主循环
         while True:
             # 获取用户输入并去除首尾空格
-            user_input = input("User: ").strip()
+            user_input = (await asyncio.to_thread(input, "User: ")).strip()
             # 检查是否退出
             if user_input.lower() in {"quit", "exit", "q"}:
                 print("拜拜!")
@@ -558,7 +792,7 @@ def main():
                 print("请输入聊天内容！")
                 continue
             # 处理用户输入并选择是否流式输出响应
-            graph_response(graph, user_input, config, tool_config)
+            await graph_response(graph, user_input, config, tool_config)
 
     except ConnectionPoolError as e:
         # 捕获连接池相关的异常
@@ -579,11 +813,16 @@ def main():
         print(f"错误: 发生未知错误 - {e}")
         sys.exit(1)
     finally:
-        # 清理资源
+        # 清理资源，先提交队列中剩余的记忆
+        if profiles:
+            await profiles.stop()
         if conn_pool and not conn_pool.closed:
-            conn_pool.close()
+            await conn_pool.close()
             logger.info("Database connection pool closed")
 
 if __name__ == "__main__":
+    # psycopg 异步连接在 Windows 下需要 SelectorEventLoop
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     # 调用主函数
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""测量每次请求重新构建节点链的开销：bind_tools、with_structured_output、prompt | llm 组合，
+以及旧实现在提示缓存命中时写入的一行 INFO 日志。
+
+在项目根目录执行：
+    python -m benchmarks.bench_chain_build --rounds 2000
+
+不发起任何网络请求，ChatOpenAI 使用占位 api_key 构造。
+"""
+import time
+import argparse
+import statistics
+from langchain_openai import ChatOpenAI
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+from utils.tools import get_tools
+from utils.log import Logger
+
+logger = Logger()
+
+PROMPTS = {
+    name: f"prompts/prompt_template_{name}.txt" for name in ("agent", "grade", "rewrite", "generate")
+}
+
+class DocumentRelevanceScore(BaseModel):
+    binary_score: str = Field(description="Relevance score 'yes' or 'no'")
+
+def _load_prompts() -> dict:
+    prompts = {}
+    for name, path in PROMPTS.items():
+        with open(path, "r", encoding="utf-8") as f:
+            prompts[name] = ChatPromptTemplate.from_template(f.read())
+    return prompts
+
+def _build_per_request(llm, tools, prompts: dict, log: bool) -> dict:
+    # 旧实现：agent / grade / generate 各构建一次（不含重写），每次命中提示缓存写一行日志
+    chains = {
+        "agent": prompts["agent"] | llm.bind_tools(tools),
+        "grade": prompts["grade"] | llm.with_structured_output(DocumentRelevanceScore),
+        "generate": prompts["generate"] | llm,
+    }
+    if log:
+        for name in chains:
+            logger.info(f"使用缓存的提示: {PROMPTS[name]}")
+    return chains
+
+def _timeit(fn, rounds: int) -> list[float]:
+    costs = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        costs.append((time.perf_counter() - started) * 1e6)
+    return costs
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    llm = ChatOpenAI(model="qwen-max", api_key="bench", base_url="http://localhost:1")
+    tools = get_tools(None, None, None)
+    prompts = _load_prompts()
+    prebuilt = _build_per_request(llm, tools, prompts, log=False)
+
+    cases = {
+        "bind_tools": lambda: llm.bind_tools(tools),
+        "with_structured_output": lambda: llm.with_structured_output(DocumentRelevanceScore),
+        "prompt | llm": lambda: prompts["generate"] | llm,
+        "INFO 日志一行": lambda: logger.info("使用缓存的提示: bench"),
+        "每请求重建（不含日志）": lambda: _build_per_request(llm, tools, prompts, log=False),
+        "每请求重建（含日志）": lambda: _build_per_request(llm, tools, prompts, log=True),
+        "建图时构建后复用": lambda: prebuilt["agent"],
+    }
+
+    print(f"{'项目':<24}{'p50(us)':>12}{'p99(us)':>12}")
+    for name, fn in cases.items():
+        costs = sorted(_timeit(fn, args.rounds))
+        p99 = costs[min(len(costs) - 1, int(len(costs) * 0.99))]
+        print(f"{name:<24}{statistics.median(costs):>12.1f}{p99:>12.1f}")
+
+if __name__ == "__main__":
+    main()
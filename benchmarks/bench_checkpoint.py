@@ -0,0 +1,186 @@
+"""比较检查点持久化模式下每个请求的 Postgres 往返次数与附加延迟。
+
+图的结构与线上一致（fast_route -> agent -> call_tools -> grade_documents -> generate -> compact），
+节点只用 asyncio.sleep 模拟 LLM 与工具耗时、输出与线上相近大小的消息，不发起网络请求。
+对比项：
+- 无检查点：基线，其余各项减去它即为检查点带来的附加延迟
+- sync / async / exit 三种持久化模式（CHECKPOINT_DURABILITY）
+- 父类 AsyncPostgresSaver（进程级锁串行化所有读写）与 PooledPostgresSaver（按连接池并发）
+
+连接经本地 TCP 代理转发，由代理统计往返次数；--rtt-ms 让代理按该往返时间延迟转发，模拟跨机房的数据库。
+会话以 bench- 开头，运行前后都会删除。在项目根目录执行：
+    python -m benchmarks.bench_checkpoint --db postgresql://postgres:密码@localhost:5432/数据库名 --requests 40 --concurrency 8 --rtt-ms 1
+"""
+import time
+import asyncio
+import argparse
+import statistics
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.graph import StateGraph, START, END
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from ancient_rag import COMPACT_NODE, MessagesState, PooledPostgresSaver, compact_state
+
+class LatencyProxy:
+    """数据库前的 TCP 代理：统计往返次数（客户端收到服务端数据后再次发送记为一次），
+    并在每个方向上延迟 rtt / 2 转发，模拟跨机房的数据库；pipeline 中连续发送的语句只算一次往返
+    """
+
+    def __init__(self, conninfo: str, rtt: float):
+        params = conninfo_to_dict(conninfo)
+        self.params = params
+        self.host = params.get("host") or "localhost"
+        self.port = int(params.get("port") or 5432)
+        self.delay = rtt / 2
+        self.trips = 0
+        self.server = None
+        self.handlers = set()
+
+    async def _open_upstream(self):
+        # host 为目录时是 Unix 套接字
+        if self.host.startswith("/"):
+            return await asyncio.open_unix_connection(f"{self.host}/.s.PGSQL.{self.port}")
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def _pump(self, reader, writer, state: dict, direction: str):
+        queue = asyncio.Queue()
+
+        async def forward():
+            while (item := await queue.get()) is not None:
+                due, data = item
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                writer.write(data)
+                await writer.drain()
+            writer.close()
+
+        task = asyncio.create_task(forward())
+        try:
+            while data := await reader.read(65536):
+                if direction == "up" and state["last"] != "up":
+                    self.trips += 1
+                state["last"] = direction
+                queue.put_nowait((time.perf_counter() + self.delay, data))
+        except ConnectionError:
+            pass
+        queue.put_nowait(None)
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _handle(self, client_reader, client_writer):
+        self.handlers.add(asyncio.current_task())
+        server_reader, server_writer = await self._open_upstream()
+        state = {"last": None}
+        await asyncio.gather(self._pump(client_reader, server_writer, state, "up"),
+                             self._pump(server_reader, client_writer, state, "down"))
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return make_conninfo(**{**self.params, "host": "127.0.0.1", "port": port, "sslmode": "disable"})
+
+    async def stop(self):
+        # 连接池关闭后两个方向依次读到 EOF，等转发任务自行结束
+        self.server.close()
+        await asyncio.wait(self.handlers, timeout=5)
+
+def build_graph(node_delay: float, context_chars: int, checkpointer=None):
+    context = "岐伯曰：阴阳者，天地之道也。" * (context_chars // 14)
+    answer = "阴阳是天地运行的根本规律。" * 40
+
+    async def fast_route(state):
+        return {"messages": [AIMessage(content="", tool_calls=[{"name": "retriever_tool", "args": {"query": "阴阳"}, "id": f"call-{time.time_ns()}"}])]}
+
+    async def call_tools(state):
+        await asyncio.sleep(node_delay)
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": [ToolMessage(content=context, name=call["name"], tool_call_id=call["id"])]}
+
+    async def grade_documents(state):
+        await asyncio.sleep(node_delay)
+        return {"relevance_score": "yes"}
+
+    async def generate(state):
+        await asyncio.sleep(node_delay)
+        return {"messages": [AIMessage(content=answer)]}
+
+    workflow = StateGraph(MessagesState)
+    for name, node in (("fast_route", fast_route), ("call_tools", call_tools), ("grade_documents", grade_documents),
+                       ("generate", generate), (COMPACT_NODE, compact_state)):
+        workflow.add_node(name, node)
+    workflow.add_edge(START, "fast_route")
+    workflow.add_edge("fast_route", "call_tools")
+    workflow.add_edge("call_tools", "grade_documents")
+    workflow.add_edge("grade_documents", "generate")
+    workflow.add_edge("generate", COMPACT_NODE)
+    workflow.add_edge(COMPACT_NODE, END)
+    return workflow.compile(checkpointer=checkpointer)
+
+async def run_case(graph, durability, args, prefix: str) -> list[float]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i: int):
+        config = {"configurable": {"thread_id": f"{prefix}-{i % args.threads}", "user_id": "bench"}}
+        kwargs = {"durability": durability} if durability else {}
+        async with semaphore:
+            started = time.perf_counter()
+            async for _ in graph.astream({"messages": [{"role": "user", "content": f"阴阳问题{i}"}], "rewrite_count": 0},
+                                         config, **kwargs):
+                pass
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    return latencies
+
+async def cleanup(pool: AsyncConnectionPool):
+    async with pool.connection() as conn:
+        for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+            await conn.execute(f"DELETE FROM {table} WHERE thread_id LIKE 'bench-%%'")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=8, help="请求轮流落在多少个会话上，会话越少每个会话的历史越长")
+    parser.add_argument("--node-ms", type=float, default=20, help="每个节点模拟的 LLM / 工具耗时")
+    parser.add_argument("--rtt-ms", type=float, default=0, help="每次数据库往返附加的延迟")
+    parser.add_argument("--context-chars", type=int, default=2000)
+    args = parser.parse_args()
+
+    proxy = LatencyProxy(args.db, args.rtt_ms / 1000)
+    conninfo = await proxy.start()
+    kwargs = {"autocommit": True, "prepare_threshold": 0}
+    async with AsyncConnectionPool(conninfo, min_size=4, max_size=20, kwargs=kwargs, open=False) as pool:
+        await PooledPostgresSaver(pool).setup()
+        await cleanup(pool)
+
+        cases = [("无检查点", None, None)]
+        for durability in ("sync", "async", "exit"):
+            cases.append((f"{durability} / 父类锁", durability, AsyncPostgresSaver))
+            cases.append((f"{durability} / 连接池", durability, PooledPostgresSaver))
+
+        results = []
+        for index, (name, durability, saver_class) in enumerate(cases):
+            graph = build_graph(args.node_ms / 1000, args.context_chars, saver_class(pool) if saver_class else None)
+            # 预热：建立连接、预编译语句
+            await run_case(graph, durability, argparse.Namespace(**{**vars(args), "requests": args.concurrency}), f"bench-warm{index}")
+            trips = proxy.trips
+            started = time.perf_counter()
+            latencies = await run_case(graph, durability, args, f"bench-{index}")
+            elapsed = time.perf_counter() - started
+            results.append((name, latencies, elapsed, proxy.trips - trips))
+        await cleanup(pool)
+    await proxy.stop()
+
+    base = statistics.mean(results[0][1])
+    print(f"请求数: {args.requests}，并发: {args.concurrency}，节点耗时: {args.node_ms}ms，附加往返延迟: {args.rtt_ms}ms")
+    print(f"{'方式':<16}{'往返/请求':>10}{'平均(ms)':>10}{'p95(ms)':>10}{'附加(ms)':>10}{'请求/秒':>10}")
+    for name, latencies, elapsed, trips in results:
+        mean = statistics.mean(latencies)
+        p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1]
+        print(f"{name:<16}{trips / args.requests:>10.1f}{mean * 1000:>10.1f}{p95 * 1000:>10.1f}"
+              f"{(mean - base) * 1000:>10.1f}{args.requests / elapsed:>10.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
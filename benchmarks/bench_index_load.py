@@ -0,0 +1,103 @@
+"""对比 FAISS.load_local（pickle 文档库 + 整体读入）与紧凑 mmap 格式的启动耗时与内存占用。
+
+在项目根目录执行：
+    python -m benchmarks.bench_index_load                 # 使用仓库自带 faiss_db
+    python -m benchmarks.bench_index_load --synthetic 100000
+
+每种格式在独立子进程中测量，RssAnon 为进程私有内存，RssFile 为可在进程间共享的文件页。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+def _rss() -> dict:
+    stats = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon", "RssFile")):
+                key, value = line.split(":")
+                stats[key] = int(value.split()[0]) // 1024
+    return stats
+
+def _measure(fmt: str, db_path: str):
+    from langchain_core.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+    from utils.index_store import load_compact
+
+    embed = FakeEmbeddings(size=1)
+    before = _rss()
+    started = time.perf_counter()
+    stores = []
+    for name in ("raw", "trans", "note"):
+        path = os.path.join(db_path, name)
+        if fmt == "pickle":
+            stores.append(FAISS.load_local(path, embed, allow_dangerous_deserialization=True))
+        else:
+            stores.append(load_compact(path, embed))
+    load_ms = (time.perf_counter() - started) * 1000
+    loaded = _rss()
+
+    dims = stores[0].index.d
+    started = time.perf_counter()
+    for store in stores:
+        store.similarity_search_by_vector(np.random.rand(dims).astype("float32").tolist(), k=3)
+    query_ms = (time.perf_counter() - started) * 1000
+    queried = _rss()
+
+    print(json.dumps({
+        "format": fmt,
+        "load_ms": round(load_ms, 1),
+        "first_query_ms": round(query_ms, 1),
+        "anon_mb_after_load": loaded["RssAnon"] - before["RssAnon"],
+        "file_mb_after_load": loaded["RssFile"] - before["RssFile"],
+        "anon_mb_after_query": queried["RssAnon"] - before["RssAnon"],
+        "file_mb_after_query": queried["RssFile"] - before["RssFile"],
+    }))
+
+def _synthetic(db_path: str, size: int, dims: int):
+    from langchain_core.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+    from utils.index_store import export_compact
+
+    rng = np.random.default_rng(0)
+    for name in ("raw", "trans", "note"):
+        vectors = rng.random((size, dims), dtype=np.float32)
+        texts = [f"合成分块 {name}-{i} " + "黄帝问曰" * 100 for i in range(size)]
+        metadatas = [{"篇名": f"第{i // 10}篇", "字段": name, "段号": i % 10 + 1} for i in range(size)]
+        store = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), FakeEmbeddings(size=dims), metadatas=metadatas)
+        path = os.path.join(db_path, name)
+        store.save_local(path)
+        export_compact(store, path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", default="faiss_db")
+    parser.add_argument("--synthetic", type=int, default=0, help="每个索引的合成向量数，0 表示使用 --db-path")
+    parser.add_argument("--dims", type=int, default=1024)
+    parser.add_argument("--measure", choices=["pickle", "compact"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        _measure(args.measure, args.db_path)
+        return
+
+    db_path = args.db_path
+    if args.synthetic:
+        db_path = tempfile.mkdtemp(prefix="bench_index_")
+        _synthetic(db_path, args.synthetic, args.dims)
+
+    for fmt in ("pickle", "compact"):
+        # 清空页缓存需要 root 权限，这里测的是热缓存下的启动
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_index_load", "--db-path", db_path, "--measure", fmt],
+            capture_output=True, text=True, check=True
+        )
+        print(result.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    main()
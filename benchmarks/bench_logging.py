@@ -0,0 +1,87 @@
+"""比较流式输出时逐块写日志对吞吐的影响（tokens/sec）。
+
+每个数据块与 main.py 一样序列化一条 SSE 帧，再按不同方式写日志：
+- 无日志：只序列化 SSE 帧
+- 同步文件：ConcurrentRotatingFileHandler 直接挂在 logger 上，每块一条 INFO（原实现）
+- 队列 JSON：QueueHandler + 后台 QueueListener 写 JSON，每块一条 INFO
+- 队列 + 采样：同上，逐块日志每 N 块一条 DEBUG，logger 级别为 INFO（新默认配置）
+
+日志写到临时目录，不影响 output/app.log。在项目根目录执行：
+    python -m benchmarks.bench_logging --tokens 20000 --sample 20
+"""
+import os
+import json
+import time
+import queue
+import logging
+import argparse
+import tempfile
+from logging.handlers import QueueHandler, QueueListener
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from utils.log import JsonFormatter, RequestIdFilter, request_id_var
+
+def _file_handler(path: str, formatter: logging.Formatter) -> ConcurrentRotatingFileHandler:
+    handler = ConcurrentRotatingFileHandler(filename=path, maxBytes=1024 * 1024 * 5, backupCount=3, encoding="utf-8")
+    handler.setFormatter(formatter)
+    return handler
+
+def _frame(chunk_id: str, chunk: str) -> str:
+    return f"data: {json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}]})}\n\n"
+
+def _stream(logger, tokens: int, sample: int, level: int) -> float:
+    """返回热路径耗时（秒）"""
+    started = time.perf_counter()
+    for i in range(1, tokens + 1):
+        chunk = "阴阳"
+        _frame("chatcmpl-bench", chunk)
+        if logger is None:
+            continue
+        if sample == 1 or (sample and (i - 1) % sample == 0):
+            logger.log(level, f"Streaming chunk #{i} from generate: {chunk}")
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--sample", type=int, default=20)
+    args = parser.parse_args()
+
+    request_id_var.set("bench")
+    tmp = tempfile.mkdtemp(prefix="bench_logging_")
+    text_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    results = []
+
+    # 预热一轮，避免首次序列化的开销算进基线
+    _stream(None, args.tokens, 0, logging.INFO)
+    results.append(("无日志", _stream(None, args.tokens, 0, logging.INFO), 0.0))
+
+    sync_logger = logging.getLogger("bench.sync")
+    sync_logger.propagate = False
+    sync_logger.setLevel(logging.DEBUG)
+    sync_logger.handlers = [_file_handler(os.path.join(tmp, "sync.log"), text_format)]
+    results.append(("同步文件，每块 INFO", _stream(sync_logger, args.tokens, 1, logging.INFO), 0.0))
+
+    for name, level, sample in (("队列 JSON，每块 INFO", logging.INFO, 1),
+                                (f"队列 JSON，每 {args.sample} 块 DEBUG", logging.DEBUG, args.sample)):
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+        queued_logger = logging.getLogger(f"bench.queue.{sample}")
+        queued_logger.propagate = False
+        queued_logger.setLevel(logging.INFO)
+        queued_logger.handlers = [queue_handler]
+        listener = QueueListener(log_queue, _file_handler(os.path.join(tmp, f"queue_{sample}.log"), JsonFormatter()))
+        listener.start()
+        elapsed = _stream(queued_logger, args.tokens, sample, level)
+        # 后台线程写完积压日志的时间，不在请求路径上
+        drain_started = time.perf_counter()
+        listener.stop()
+        results.append((name, elapsed, time.perf_counter() - drain_started))
+
+    print(f"数据块数: {args.tokens}，日志目录: {tmp}")
+    print(f"{'方式':<24}{'tokens/sec':>14}{'热路径(ms)':>14}{'后台落盘(ms)':>14}")
+    for name, elapsed, drain in results:
+        print(f"{name:<24}{args.tokens / elapsed:>14.0f}{elapsed * 1000:>14.1f}{drain * 1000:>14.1f}")
+
+if __name__ == "__main__":
+    main()
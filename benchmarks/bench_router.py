@@ -0,0 +1,108 @@
+"""在回放日志上统计快速路由节省的 agent LLM 调用次数。
+
+问题来源（二选一）：
+- 服务日志 output/app.log 中的“用户输入：”记录（默认，JSON 与纯文本格式均可）
+- --questions 指定的文本文件，每行一个问题；可附加制表符分隔的期望标签
+  （retrieve / web / chat / agent），用于统计快速路由的判定准确率
+
+在项目根目录执行：
+    python -m benchmarks.bench_router --log output/app.log
+    python -m benchmarks.bench_router --questions replay.tsv --embed
+
+默认只做关键词匹配，不发起网络请求；加 --embed 时使用 Config.embed1 启用向量分类。
+"""
+import re
+import json
+import asyncio
+import argparse
+from collections import Counter
+from utils.router import FastRouter
+
+_USER_INPUT = re.compile(r" - INFO - (?:\[[^\]]*\] )?用户输入：(.*)$")
+_PREFIX = "用户输入："
+
+def load_log(path: str) -> list[tuple[str, str]]:
+    questions = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("{"):
+                try:
+                    message = json.loads(line).get("message", "")
+                except ValueError:
+                    continue
+                question = message[len(_PREFIX):] if message.startswith(_PREFIX) else ""
+            else:
+                match = _USER_INPUT.search(line)
+                question = match.group(1) if match else ""
+            if question.strip():
+                questions.append((question.strip(), None))
+    return questions
+
+def load_questions(path: str) -> list[tuple[str, str]]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            question, _, label = line.rstrip("\n").partition("\t")
+            questions.append((question.strip(), label.strip() or None))
+    return questions
+
+async def replay(router: FastRouter, questions: list[tuple[str, str]]):
+    decisions = Counter()
+    labeled = correct = 0
+    mistakes = []
+    for question, expected in questions:
+        decision = await router.route(question)
+        label = decision.label or "agent"
+        decisions[(label, decision.source)] += 1
+        if expected:
+            labeled += 1
+            # 交给 agent 不算错误，只是没有节省调用
+            if label == expected or label == "agent":
+                correct += 1
+            else:
+                mistakes.append((question, expected, label))
+    return decisions, labeled, correct, mistakes
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default="output/app.log")
+    parser.add_argument("--questions", default=None)
+    parser.add_argument("--embed", action="store_true", help="使用 Config.embed1 启用向量分类")
+    parser.add_argument("--titles", default="data/hdwj.json")
+    parser.add_argument("--examples", default="data/router_examples.json")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--margin", type=float, default=0.05)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions) if args.questions else load_log(args.log)
+    if not questions:
+        print("回放日志中没有找到问题")
+        return
+
+    embed = None
+    if args.embed:
+        from config import Config
+        embed = Config.embed1
+    router = FastRouter.from_files(args.titles, args.examples, embed, threshold=args.threshold, margin=args.margin)
+
+    async def _run():
+        await router.setup()
+        return await replay(router, questions)
+
+    decisions, labeled, correct, mistakes = asyncio.run(_run())
+    stats = router.stats()
+
+    print(f"回放问题数: {stats['total']}")
+    for (label, source), count in sorted(decisions.items()):
+        print(f"  {label:<10}{source:<12}{count:>6}")
+    print(f"节省 agent LLM 调用: {stats['llm_saved']} / {stats['total']}（{stats['saved_rate']:.1%}）")
+    if labeled:
+        print(f"带标签问题 {labeled} 条，判定正确或交给 agent: {correct}（{correct / labeled:.1%}）")
+        for question, expected, label in mistakes:
+            print(f"  误判: {question}  期望 {expected}，实际 {label}")
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,8 @@ class Config:
     llm1 = ChatOpenAI(model='qwen-max',
                   temperature=0.5,
                   extra_body={"enable_search": True},
+                  # 流式调用时也返回 token 用量，用于请求预算统计
+                  stream_usage=True,
                   api_key=DASHSCOPE_API_KEY,
                   base_url=DASHSCOPE_API_URL
 )
@@ -26,6 +28,110 @@ class Config:
 
     DB_URI = os.getenv("DB_URI", "postgresql://postgres:密码@localhost:5432/数据库名")
 
+    # 查询嵌入缓存：进程内 LRU 容量、过期秒数（内存层与持久层共用），sqlite 持久层路径（置空则关闭持久层）
+    # 与持久层最多保留的条数（0 表示不限）
+    EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 2048))
+    EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", 24 * 3600))
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "output/embed_cache.sqlite")
+    EMBED_CACHE_DISK_ROWS = int(os.getenv("EMBED_CACHE_DISK_ROWS", 100000))
+
+    # 用户长期记忆：画像缓存的用户数与有效期（秒），画像取最近的若干条记忆；
+    # “记住”经后台队列攒批写入，每批最多条数与最长等待秒数
+    MEMORY_PROFILE_CACHE_SIZE = int(os.getenv("MEMORY_PROFILE_CACHE_SIZE", 1024))
+    MEMORY_PROFILE_TTL = float(os.getenv("MEMORY_PROFILE_TTL", 300))
+    MEMORY_LIMIT = int(os.getenv("MEMORY_LIMIT", 10))
+    MEMORY_WRITE_BATCH = int(os.getenv("MEMORY_WRITE_BATCH", 32))
+    MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", 0.5))
+
+    # 检查点持久化模式：sync 每个节点的检查点写完再执行下一个节点；async（默认）写入与下一个节点并发，
+    # 进程崩溃时可能丢失最后一步；exit 只在本轮结束时写一次，中途崩溃或客户端断开时本轮不保存
+    CHECKPOINT_DURABILITY = os.getenv("CHECKPOINT_DURABILITY", "async")
+
+    # 检查点清理：每个会话保留最新的检查点数、空闲会话过期天数（0 表示不过期）、
+    # 后台清理间隔秒数（0 表示关闭）与每条 DELETE 的最大行数
+    CHECKPOINT_KEEP_LATEST = int(os.getenv("CHECKPOINT_KEEP_LATEST", 20))
+    CHECKPOINT_IDLE_TTL = float(os.getenv("CHECKPOINT_IDLE_TTL_DAYS", 30)) * 86400
+    CHECKPOINT_RETENTION_INTERVAL = int(os.getenv("CHECKPOINT_RETENTION_INTERVAL", 3600))
+    CHECKPOINT_RETENTION_BATCH = int(os.getenv("CHECKPOINT_RETENTION_BATCH", 500))
+
+    # 语义答案缓存（pgvector）：余弦相似度阈值与有效期（秒）
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+
+    # 向量库构建：每批文本数（text-embedding-v3 单次上限 10）、并发线程数、每秒最大请求数
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 10))
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", 4))
+    EMBED_RATE_LIMIT = float(os.getenv("EMBED_RATE_LIMIT", 10))
+    # 索引类型：flat / hnsw / ivfpq / sq8，语料规模增大后可改用近似索引
+    FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+
+    # 索引热更新：轮询 faiss_db 的间隔秒数（0 表示关闭），以及 /admin 接口的访问令牌
+    INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", 30))
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+    # 认证：bcrypt 专用线程数与最大排队数（超出返回 503）；会话令牌签名密钥与有效期（秒），
+    # REQUIRE_SESSION 为 true 时 /v1/chat/completions 必须携带 Authorization: Bearer 令牌
+    AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", 2))
+    AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", 32))
+    SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+    SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+    REQUIRE_SESSION = os.getenv("REQUIRE_SESSION", "false").lower() == "true"
+
+    # 文档相关性评估：模式 llm / local / hybrid，本地信号 score / lexical / cross_encoder；
+    # hybrid 模式下本地分数落在 阈值 ± 间隔 内才调用 LLM
+    GRADE_MODE = os.getenv("GRADE_MODE", "hybrid")
+    GRADE_SIGNAL = os.getenv("GRADE_SIGNAL", "score")
+    GRADE_THRESHOLD = float(os.getenv("GRADE_THRESHOLD", 0.55))
+    GRADE_MARGIN = float(os.getenv("GRADE_MARGIN", 0.1))
+    GRADE_CROSS_ENCODER_MODEL = os.getenv("GRADE_CROSS_ENCODER_MODEL", "BAAI/bge-reranker-base")
+    # 推测生成：评估与生成并发执行，评估为 no 时取消生成（评估为 no 时会多消耗一次生成的 token）
+    SPECULATIVE_GENERATE = os.getenv("SPECULATIVE_GENERATE", "false").lower() == "true"
+
+    # 快速路由：篇名关键词与带标签样例的向量相似度命中时跳过 agent 的 LLM 调用
+    FAST_ROUTER = os.getenv("FAST_ROUTER", "true").lower() == "true"
+    FAST_ROUTER_TITLES = os.getenv("FAST_ROUTER_TITLES", "data/hdwj.json")
+    FAST_ROUTER_EXAMPLES = os.getenv("FAST_ROUTER_EXAMPLES", "data/router_examples.json")
+    FAST_ROUTER_THRESHOLD = float(os.getenv("FAST_ROUTER_THRESHOLD", 0.8))
+    FAST_ROUTER_MARGIN = float(os.getenv("FAST_ROUTER_MARGIN", 0.05))
+
+    # 单次请求预算：耗时秒数与 token 数（0 表示不限制），用完后跳过评估与重写直接生成
+    REQUEST_TIME_BUDGET = float(os.getenv("REQUEST_TIME_BUDGET", 30))
+    REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", 20000))
+
+    # 工具执行器：常驻线程数、各工具并发上限与单次调用超时（秒）
+    TOOL_EXECUTOR_WORKERS = int(os.getenv("TOOL_EXECUTOR_WORKERS", 16))
+    TOOL_CONCURRENCY = {
+        "retriever_tool": int(os.getenv("RETRIEVER_TOOL_CONCURRENCY", 8)),
+        "my_web_search1": int(os.getenv("WEB_SEARCH_CONCURRENCY", 2)),
+    }
+    TOOL_TIMEOUTS = {
+        "retriever_tool": float(os.getenv("RETRIEVER_TOOL_TIMEOUT", 10)),
+        "my_web_search1": float(os.getenv("WEB_SEARCH_TIMEOUT", 15)),
+    }
+    TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_DEFAULT_TIMEOUT", 30))
+    # 联网搜索结果缓存有效期（秒）
+    WEB_SEARCH_CACHE_TTL = int(os.getenv("WEB_SEARCH_CACHE_TTL", 6 * 3600))
+
+    # 上下文预算：检索内容的 token 上限（0 表示不截断）；历史对话取最近若干条，
+    # 其中最后几条原样保留，更早的压缩为摘要，助手回答摘要保留的字数
+    RETRIEVAL_CONTEXT_TOKENS = int(os.getenv("RETRIEVAL_CONTEXT_TOKENS", 2000))
+    HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", 10))
+    HISTORY_KEEP_VERBATIM = int(os.getenv("HISTORY_KEEP_VERBATIM", 3))
+    HISTORY_SUMMARY_CHARS = int(os.getenv("HISTORY_SUMMARY_CHARS", 60))
+
+    # 会话状态压缩：每轮结束时删除工具调用、工具输出与重写等中间消息，并只保留最近若干条问答（0 表示不限条数），
+    # 检查点大小不再随对话轮数增长
+    STATE_COMPACTION = os.getenv("STATE_COMPACTION", "true").lower() == "true"
+    STATE_MAX_MESSAGES = int(os.getenv("STATE_MAX_MESSAGES", HISTORY_WINDOW))
+
+    # 流式输出的逐块日志每 N 块记录一条 DEBUG（0 表示不记录）；日志级别与格式见 utils/log.py 的 LOG_LEVEL、LOG_FORMAT
+    LOG_TOKEN_SAMPLE = int(os.getenv("LOG_TOKEN_SAMPLE", 20))
+
+    # OpenTelemetry 追踪（需安装 opentelemetry-api，导出器按 OTel 标准环境变量配置）；Prometheus 指标始终在 /metrics 提供
+    OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() == "true"
+    OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "tcm-agentic-rag")
+
     HOST = "0.0.0.0"
 
     PORT = 8000
@@ -1,38 +1,49 @@
 from contextlib import asynccontextmanager
+import asyncio
 import re
 import time
 from typing import List, Optional, Tuple
 import uuid
+import hmac
 import json
 import uvicorn
-from fastapi.responses import JSONResponse, StreamingResponse
-from utils.log import Logger
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from utils.log import Logger, request_id_var
 from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from config import Config
 from utils.tools import ToolConfig
+from utils.embed_cache import CachedEmbeddings
+from utils.answer_cache import AnswerCache
+from utils.tool_executor import get_tool_executor
+from utils.auth import AuthBusyError, PasswordHasher, SessionSigner
+from utils.checkpoint_retention import CheckpointRetention
+from utils.metrics import REQUEST_LATENCY, observe, register_pool, render, setup_tracing, unregister_pool, watch_llm_retries
+from utils.context_budget import token_report
+from langchain_core.messages import HumanMessage, AIMessage, RemoveMessage, ToolMessage
 from ancient_rag import (
     create_graph,
+    create_grader,
+    create_router,
+    create_profile_cache,
+    request_budget,
+    checkpoint_durability,
+    grade_decision,
+    COMPACT_NODE,
     save_graph_visualization,
     ConnectionPoolError,
-    monitor_connection,
-    ConnectionPool
+    AsyncConnectionPool
 )
 import sys
-from passlib.context import CryptContext
 
 logger = Logger()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-conn_pool: ConnectionPool | None = None
-
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(password: str, hash: str) -> bool:
-    return pwd_context.verify(password, hash)
+conn_pool: AsyncConnectionPool | None = None
+answer_cache: AnswerCache | None = None
+# bcrypt 在独立的定长线程池中执行；登录签发的会话令牌校验时不访问数据库
+password_hasher = PasswordHasher(max_workers=Config.AUTH_WORKERS, max_pending=Config.AUTH_MAX_PENDING)
+session_signer = SessionSigner(Config.SESSION_SECRET, ttl=Config.SESSION_TTL)
 
 class RegisterRequest(BaseModel):
     username: str
@@ -85,37 +96,60 @@ def format_response(response):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global graph, tool_config, conn_pool
+    global graph, tool_config, conn_pool, answer_cache
+    embed = None
+    grader = None
+    router = None
+    retention = None
+    profiles = None
 
     try:
-        llm, embed = Config.llm1, Config.embed1
+        llm = Config.llm1
+        # FAISS 检索与 PostgresStore 记忆共用同一个嵌入缓存
+        embed = CachedEmbeddings(
+            Config.embed1,
+            maxsize=Config.EMBED_CACHE_SIZE,
+            ttl=Config.EMBED_CACHE_TTL,
+            persist_path=Config.EMBED_CACHE_PATH or None,
+            persist_max_rows=Config.EMBED_CACHE_DISK_ROWS
+        )
         tool_config = ToolConfig(embed=embed, llm=Config.llm2)
 
+        # prepare_threshold=0 表示语句首次执行即预编译（None 才是关闭），检查点的固定 SQL 从第二次起只传参数
         connection_kwargs = {
             "autocommit": True,
             "prepare_threshold": 0,
             "connect_timeout": 5
         }
 
-        conn_pool = ConnectionPool(
+        conn_pool = AsyncConnectionPool(
             conninfo=Config.DB_URI,
             max_size=20,
             min_size=2,
             kwargs=connection_kwargs,
-            timeout=10
+            timeout=10,
+            open=False
         )
         try:
-            conn_pool.open()
+            await conn_pool.open()
             logger.info("数据库连接池已打开")
             logger.debug("数据库连接池已打开")
         except Exception as e:
             logger.error(f"数据库连接池打开失败: {e}")
             raise ConnectionPoolError("数据库连接池打开失败")
-        
-        monitor_thread = monitor_connection(conn_pool, interval=60)
+
+        # 连接池状态在 /metrics 抓取时读取，LLM 重试与 OTel 追踪按需启用
+        register_pool(conn_pool)
+        watch_llm_retries()
+        if Config.OTEL_ENABLED:
+            setup_tracing(Config.OTEL_SERVICE_NAME)
+        logger.info(f"检查点持久化模式: {checkpoint_durability()}")
 
         try:
-            graph = create_graph(conn_pool, llm, embed, tool_config)
+            grader = create_grader()
+            router = create_router(embed)
+            profiles = create_profile_cache()
+            graph = await create_graph(conn_pool, llm, embed, tool_config, grader, router, profiles)
         except Exception as e:
             logger.error(f"创建图失败: {e}")
             print("错误: 创建图失败")
@@ -123,6 +157,42 @@ async def lifespan(app: FastAPI):
 
         save_graph_visualization(graph)
 
+        try:
+            await tool_config.search_cache.setup(conn_pool)
+        except Exception as e:
+            # 建表失败时搜索缓存退化为进程内合并
+            logger.error(f"搜索缓存初始化失败，仅在进程内合并相同搜索: {e}")
+
+        # 检查点只增不减，后台定期删除旧检查点、空闲会话与失去引用的数据
+        if Config.CHECKPOINT_RETENTION_INTERVAL > 0:
+            retention = CheckpointRetention(
+                conn_pool,
+                keep_latest=Config.CHECKPOINT_KEEP_LATEST,
+                idle_ttl=Config.CHECKPOINT_IDLE_TTL,
+                batch_size=Config.CHECKPOINT_RETENTION_BATCH
+            )
+            retention.start(Config.CHECKPOINT_RETENTION_INTERVAL)
+
+        # 监听 faiss_db 变化，索引重建后自动热加载
+        if Config.INDEX_WATCH_INTERVAL > 0:
+            tool_config.index_registry.watch(Config.INDEX_WATCH_INTERVAL)
+
+        if Config.ANSWER_CACHE_ENABLED:
+            try:
+                answer_cache = AnswerCache(
+                    conn_pool,
+                    embed,
+                    threshold=Config.ANSWER_CACHE_THRESHOLD,
+                    ttl=Config.ANSWER_CACHE_TTL,
+                    index_registry=tool_config.index_registry
+                )
+                await answer_cache.setup()
+                logger.info("答案缓存已启用")
+            except Exception as e:
+                # 答案缓存是可选加速项，初始化失败不影响主流程
+                logger.error(f"答案缓存初始化失败，已禁用: {e}")
+                answer_cache = None
+
     except ConnectionPoolError as e:
         # 捕获连接池相关的异常
         logger.error(f"连接池错误: {e}")
@@ -144,8 +214,43 @@ async def lifespan(app: FastAPI):
 
     yield
 
+    unregister_pool()
+
+    if retention:
+        await retention.stop()
+        logger.info(f"检查点清理统计: {retention.stats()}")
+
+    # 连接池关闭前提交队列中剩余的记忆
+    if profiles:
+        await profiles.stop()
+        logger.info(f"用户画像缓存统计: {profiles.stats()}")
+
+    if tool_config:
+        tool_config.index_registry.stop()
+
+    if embed:
+        logger.info(f"嵌入缓存统计: {embed.stats()}")
+
+    if grader:
+        logger.info(f"文档评估统计: {grader.stats()}")
+
+    if router:
+        logger.info(f"快速路由统计: {router.stats()}")
+
+    if tool_config:
+        logger.info(f"搜索缓存统计: {tool_config.search_cache.stats()}")
+
+    logger.info(f"上下文 token 统计: {token_report.stats()}")
+
+    executor = get_tool_executor()
+    logger.info(f"工具执行器统计: {executor.stats()}")
+    executor.shutdown()
+
+    logger.info(f"认证哈希统计: {password_hasher.stats()}")
+    password_hasher.shutdown()
+
     if conn_pool and not conn_pool.closed:
-            conn_pool.close()
+            await conn_pool.close()
             logger.info("数据库连接池已关闭")
 
     logger.info("服务器已关闭")
@@ -160,35 +265,81 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有请求头
 )
 
-async def handle_non_stream_response(user_input, graph, tool_config, config):
-
-    content = None
+async def use_answer_cache(graph, config, user_input: str) -> bool:
+    # 含“记住”的请求需要经过 agent 写入记忆，不走答案缓存
+    if answer_cache is None or "记住" in user_input:
+        return False
+    # 缓存只以本轮问题为键；会话中已有对话时，追问（如“详细说说”“那它的出处呢”）的含义依赖上文，
+    # 会命中其他会话的答案，因此只在会话的第一轮查询与写入缓存
     try:
-        events = graph.stream({"messages": [{"role": "user", "content": user_input}], "rewrite_count": 0}, config)
-        for event in events:
-            for value in event.values():
-                if "messages" not in value or not isinstance(value["messages"], list):
-                    logger.warning("回答中没有有效的消息")
-                    continue
-
-                last_message = value["messages"][-1]
-
-                if hasattr(last_message, "tool_calls") and last_message.tool_calls:
-                    for tool_call in last_message.tool_calls:
-                        if isinstance(tool_call, dict) and "name" in tool_call:
-                            logger.info(f"调用工具: {tool_call['name']}")
-
-                    continue
+        state = await graph.aget_state(config)
+    except Exception as e:
+        logger.error(f"读取会话状态失败，跳过答案缓存: {e}")
+        return False
+    return not state.values.get("messages")
 
-                if hasattr(last_message, "content"):
-                    content = last_message.content
+async def record_cached_turn(graph, config, user_input: str, answer: str):
+    """缓存命中时跳过了图的执行，把这一轮问答补写进会话状态，保证后续多轮对话上下文完整"""
+    try:
+        await graph.aupdate_state(
+            config,
+            {"messages": [HumanMessage(content=user_input), AIMessage(content=answer)]},
+            # 作为已结束的一轮写入，窗口外的历史在下一轮结束时一并压缩
+            as_node=COMPACT_NODE if Config.STATE_COMPACTION else "generate"
+        )
+    except Exception as e:
+        logger.error(f"写入缓存命中的对话记录失败: {e}")
 
-                    if hasattr(last_message, "name") and last_message.name in tool_config.get_tool_names():
-                        tool_name = last_message.name
-                        logger.info(f"工具输出[{tool_name}]: {content}")
+async def handle_non_stream_response(user_input, graph, tool_config, config):
 
-                    else:
-                        logger.info(f"最终输出：{content}")
+    content = None
+    try:
+        cacheable = await use_answer_cache(graph, config, user_input)
+        cached = await answer_cache.lookup(user_input) if cacheable else None
+        if cached:
+            content = cached
+            await record_cached_turn(graph, config, user_input, cached)
+        else:
+            events = graph.astream({"messages": [{"role": "user", "content": user_input}], "rewrite_count": 0, **request_budget()}, config,
+                                   durability=checkpoint_durability())
+
+            answer_node = None
+            source = None
+            # 整个请求固定使用同一版本的索引，热更新不影响进行中的请求
+            with tool_config.index_registry.pin():
+                async for event in events:
+                    for node_name, value in event.items():
+                        source = last_tool_message(value) or source
+                        # 快速路由交给 agent 时节点没有输出
+                        if not isinstance(value, dict) or not isinstance(value.get("messages"), list):
+                            logger.warning("回答中没有有效的消息")
+                            continue
+
+                        last_message = value["messages"][-1]
+                        # 压缩节点只输出删除标记
+                        if isinstance(last_message, RemoveMessage):
+                            continue
+
+                        if hasattr(last_message, "tool_calls") and last_message.tool_calls:
+                            for tool_call in last_message.tool_calls:
+                                if isinstance(tool_call, dict) and "name" in tool_call:
+                                    logger.info(f"调用工具: {tool_call['name']}")
+
+                            continue
+
+                        if hasattr(last_message, "content"):
+                            content = last_message.content
+
+                            if hasattr(last_message, "name") and last_message.name in tool_config.get_tool_names():
+                                tool_name = last_message.name
+                                logger.info(f"工具输出[{tool_name}]: {content}")
+
+                            else:
+                                answer_node = node_name
+                                logger.info(f"最终输出：{content}")
+
+            if answer_node in ANSWER_NODES and content and from_retrieval(source, tool_config) and cacheable:
+                await answer_cache.put(user_input, content)
 
     except Exception as e:
         logger.error(f"处理响应时发生错误: {e}")
@@ -196,7 +347,7 @@ async def handle_non_stream_response(user_input, graph, tool_config, config):
 
     formatted_response = str(format_response(content)) if content else "没有响应"
 
-    logger.info(f"格式化输出结果：{formatted_response}")
+    logger.debug(f"格式化输出结果：{formatted_response}")
 
     try:
         response = ChatCompletionResponse(
@@ -226,17 +377,93 @@ async def handle_non_stream_response(user_input, graph, tool_config, config):
             ]
         )
 
-    logger.info(f"响应结果：\n{response}")
+    logger.debug(f"响应结果：\n{response}")
     return JSONResponse(content=response.model_dump())
           
-async def handle_stream_response(user_input, graph, config):
+# 产出最终回答的节点：generate，以及推测生成模式下的 grade_documents
+ANSWER_NODES = ("generate", "grade_documents")
+
+def last_tool_message(value) -> Optional[ToolMessage]:
+    """节点输出中的最后一条工具结果"""
+    if not isinstance(value, dict) or not isinstance(value.get("messages"), list):
+        return None
+    return next((m for m in reversed(value["messages"]) if isinstance(m, ToolMessage)), None)
+
+def from_retrieval(source: Optional[ToolMessage], tool_config) -> bool:
+    """只缓存基于古籍检索生成的答案：联网搜索的结果会过时，也不随 faiss_db 版本失效；检索出错时没有 artifact"""
+    return (source is not None and source.artifact is not None
+            and tool_config.get_tool_routing_config().get(source.name) == "grade_documents")
+
+def progress_stage(node_name: str, value, tool_config, state: dict) -> Optional[str]:
+    """根据刚结束的节点推断下一阶段：retrieving / searching / grading / generating / rewriting。
+    state 为输入与各节点更新合并后的状态，评估之后的去向按图的路由函数判断"""
+    if not isinstance(value, dict):
+        return None
+    messages = value.get("messages") or []
+    last_message = messages[-1] if isinstance(messages, list) and messages else None
+
+    if node_name in ("agent", "fast_route"):
+        tool_calls = getattr(last_message, "tool_calls", None) or []
+        names = {call.get("name") for call in tool_calls if isinstance(call, dict)}
+        if not names:
+            return None
+        routing = tool_config.get_tool_routing_config()
+        return "retrieving" if any(routing.get(name) == "grade_documents" for name in names) else "searching"
+
+    if node_name == "call_tools":
+        name = getattr(last_message, "name", None)
+        return "grading" if tool_config.get_tool_routing_config().get(name) == "grade_documents" else "generating"
+
+    if node_name == "grade_documents":
+        if isinstance(last_message, AIMessage):
+            return None
+        # 与 route_after_grade 同一判断：重写次数或预算用完、评估出错时的去向都与图一致
+        return "generating" if grade_decision(state)[0] == "generate" else "rewriting"
+
+    return None
+
+def progress_event(chunk_id: str, stage: str) -> str:
+    # 与内容块同为 chat.completion.chunk，delta 为空，兼容只读取 choices 的 OpenAI 客户端
+    return f"data: {json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'progress': {'stage': stage}, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': None}]})}\n\n"
+
+async def run_graph_stream(graph, tool_config, inputs: dict, config, queue: asyncio.Queue):
+    """执行图并把 (stream_mode, data) 依次放入队列，结束或被取消时放入 None"""
+    try:
+        # 整个请求固定使用同一版本的索引，热更新不影响进行中的请求
+        with tool_config.index_registry.pin():
+            # messages 流转发 token，updates 流用于推断进度，custom 流接收推测生成的 token
+            async for item in graph.astream(
+                inputs,
+                config,
+                stream_mode=["messages", "updates", "custom"],
+                durability=checkpoint_durability()
+            ):
+                queue.put_nowait(item)
+    except asyncio.CancelledError:
+        logger.info(f"图执行已取消: {config['configurable'].get('thread_id')}")
+        raise
+    finally:
+        queue.put_nowait(None)
+
+async def watch_disconnect(request: Request, task: asyncio.Task, interval: float = 0.5):
+    """轮询客户端连接状态，断开后取消图执行，避免被放弃的请求继续消耗 LLM 额度与连接"""
+    while not task.done():
+        if await request.is_disconnected():
+            logger.info("客户端已断开连接，取消图执行")
+            task.cancel()
+            return
+        await asyncio.sleep(interval)
+
+async def handle_stream_response(user_input, graph, tool_config, config, request: Request = None):
     """
     处理流式响应的异步函数，生成并返回流式数据。
 
     Args:
         user_input (str): 用户输入的内容。
         graph: 图对象，用于处理消息流。
+        tool_config: 工具配置，提供索引注册表。
         config (dict): 配置参数，包含线程和用户标识。
+        request (Request): HTTP 请求，用于检测客户端断开。
 
     Returns:
         StreamingResponse: 流式响应对象，媒体类型为 text/event-stream。
@@ -251,40 +478,109 @@ async def handle_stream_response(user_input, graph, config):
         Raises:
             Exception: 流生成过程中可能抛出的异常。
         """
+        started = time.perf_counter()
+        # 客户端断开或图执行被取消时保持 cancelled
+        status = "cancelled"
         try:
             # 生成唯一的 chunk ID
             chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
-            # 调用 graph.stream 获取消息流
-            stream_data = graph.stream(
-                {"messages": [{"role": "user", "content": user_input}], "rewrite_count": 0},
-                config,
-                stream_mode="messages"
-            )
-            # 遍历消息流中的每个数据块
-            for message_chunk, metadata in stream_data:
-                try:
-                    # 获取当前节点名称
-                    node_name = metadata.get("langgraph_node") if metadata else None
-                    # 仅处理 generate 和 agent 节点
-                    if node_name in ["generate", "agent"]:
-                        # 获取消息内容，默认空字符串
-                        chunk = getattr(message_chunk, 'content', '')
-                        # 记录流式数据块日志
-                        logger.info(f"Streaming chunk from {node_name}: {chunk}")
+            # 答案缓存命中时直接整段返回，跳过整个图
+            cacheable = await use_answer_cache(graph, config, user_input)
+            cached = await answer_cache.lookup(user_input) if cacheable else None
+            if cached:
+                status = "cached"
+                await record_cached_turn(graph, config, user_input, cached)
+                yield f"data: {json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'choices': [{'index': 0, 'delta': {'content': cached}, 'finish_reason': None}]})}\n\n"
+                yield f"data: {json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+                return
+
+            generated = []
+            source = None
+            chunk_count = 0
+            # 先发一个进度事件，客户端在图开始执行前就能收到首字节
+            yield progress_event(chunk_id, "thinking")
+
+            # 图在独立任务中执行，客户端断开或生成器被关闭时取消该任务，
+            # 正在进行的 LLM 调用与占用的连接随之释放
+            queue = asyncio.Queue()
+            inputs = {"messages": [{"role": "user", "content": user_input}], "rewrite_count": 0, **request_budget()}
+            # 由 updates 流合并出的状态（messages 只保留最近一次更新），供进度判断使用
+            route_state = dict(inputs)
+            producer = asyncio.create_task(run_graph_stream(graph, tool_config, inputs, config, queue))
+            watcher = asyncio.create_task(watch_disconnect(request, producer)) if request else None
+            try:
+                # 遍历消息流中的每个数据块，None 表示图执行结束
+                while (item := await queue.get()) is not None:
+                    mode, data = item
+                    try:
+                        if mode == "updates":
+                            for node_name, value in data.items():
+                                source = last_tool_message(value) or source
+                                if isinstance(value, dict):
+                                    route_state.update(value)
+                                stage = progress_stage(node_name, value, tool_config, route_state)
+                                if stage:
+                                    yield progress_event(chunk_id, stage)
+                            continue
+
+                        if mode == "custom":
+                            if isinstance(data, dict) and data.get("type") == "reset":
+                                # 推测生成中途失败：已输出的部分作废，generate 节点会重新生成完整回答
+                                generated.clear()
+                                yield progress_event(chunk_id, "regenerating")
+                                continue
+                            if not isinstance(data, dict) or data.get("type") != "token":
+                                continue
+                            node_name, chunk = "grade_documents", data.get("content", "")
+                        else:
+                            message_chunk, metadata = data
+                            # 获取当前节点名称
+                            node_name = metadata.get("langgraph_node") if metadata else None
+                            # 仅处理 generate、agent 与 fast_route（寒暄直接回复）节点
+                            if node_name not in ["generate", "agent", "fast_route"]:
+                                continue
+                            # 获取消息内容，默认空字符串
+                            chunk = getattr(message_chunk, 'content', '')
+
+                        # 逐块日志按 LOG_TOKEN_SAMPLE 采样并降为 DEBUG，默认 INFO 级别下不写入
+                        chunk_count += 1
+                        if Config.LOG_TOKEN_SAMPLE and (chunk_count - 1) % Config.LOG_TOKEN_SAMPLE == 0:
+                            logger.debug(f"Streaming chunk #{chunk_count} from {node_name}: {chunk}")
+                        if node_name in ANSWER_NODES:
+                            generated.append(chunk)
                         # 产出流式数据块
                         yield f"data: {json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}]})}\n\n"
-                except Exception as chunk_error:
-                    # 记录单个数据块处理异常
-                    logger.error(f"Error processing stream chunk: {chunk_error}")
-                    continue
-
+                    except Exception as chunk_error:
+                        # 记录单个数据块处理异常
+                        logger.error(f"Error processing stream chunk: {chunk_error}")
+                        continue
+            finally:
+                if not producer.done():
+                    logger.info("流式响应已关闭，取消图执行")
+                    producer.cancel()
+                if watcher:
+                    watcher.cancel()
+
+            if producer.cancelled():
+                return
+            # 图执行中的异常在这里抛出，由外层统一处理
+            producer.result()
+            logger.info(f"流式输出完成: {chunk_count} 个数据块，回答 {sum(len(c) for c in generated)} 字")
+
+            if generated and from_retrieval(source, tool_config) and cacheable:
+                await answer_cache.put(user_input, "".join(generated))
+
+            status = "ok"
             # 产出流结束标记
             yield f"data: {json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
         except Exception as stream_error:
+            status = "error"
             # 记录流生成过程中的异常
             logger.error(f"Stream generation error: {stream_error}")
             # 产出错误提示
             yield f"data: {json.dumps({'error': 'Stream processing failed'})}\n\n"
+        finally:
+            REQUEST_LATENCY.labels(mode="stream", status=status).observe(time.perf_counter() - started)
 
     # 返回流式响应对象
     return StreamingResponse(generate_stream(), media_type="text/event-stream")
@@ -307,30 +603,25 @@ async def get_dependencies() -> Tuple[any, any]:
 
 
 @app.post("/auth/register")
-def register_user(req: RegisterRequest):
+async def register_user(req: RegisterRequest):
     try:
-        with conn_pool.connection() as conn:
-            cur = conn.cursor()
-
-            cur.execute(
-                "SELECT 1 FROM users WHERE username=%s",
-                (req.username,)
-            )
-            if cur.fetchone():
-                raise HTTPException(status_code=400, detail="用户名已存在")
-
-            user_id = uuid.uuid4()
-            pwd_hash = hash_password(req.password)
-
-            cur.execute(
-                "INSERT INTO users (id, username, password_hash) VALUES (%s, %s, %s)",
-                (user_id, req.username, pwd_hash)
+        # 先在连接外完成哈希，再用一条语句插入，用户名已存在时不插入也不返回行
+        pwd_hash = await password_hasher.hash(req.password)
+        async with conn_pool.connection() as conn:
+            cur = await conn.execute(
+                "INSERT INTO users (id, username, password_hash) VALUES (%s, %s, %s) ON CONFLICT (username) DO NOTHING RETURNING id",
+                (uuid.uuid4(), req.username, pwd_hash)
             )
+            row = await cur.fetchone()
 
+        if not row:
+            raise HTTPException(status_code=400, detail="用户名已存在")
         return {"msg": "注册成功"}
 
     except HTTPException:
         raise
+    except AuthBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"注册异常: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="注册失败")
@@ -341,37 +632,76 @@ class LoginRequest(BaseModel):
     password: str
 
 @app.post("/auth/login")
-def login_user(req: LoginRequest):
+async def login_user(req: LoginRequest):
     try:
-        with conn_pool.connection() as conn:
+        async with conn_pool.connection() as conn:
             cur = conn.cursor()
 
-            cur.execute(
+            await cur.execute(
                 "SELECT id, password_hash FROM users WHERE username=%s",
                 (req.username,)
             )
-            row = cur.fetchone()
+            row = await cur.fetchone()
 
-            if not row:
-                raise HTTPException(status_code=401, detail="用户名或密码错误")
+        if not row:
+            raise HTTPException(status_code=401, detail="用户名或密码错误")
 
-            user_id, pwd_hash = row
-            if not verify_password(req.password, pwd_hash):
-                raise HTTPException(status_code=401, detail="用户名或密码错误")
+        user_id, pwd_hash = row
+        # 校验密码前已归还连接，避免 bcrypt 期间占用连接池
+        if not await password_hasher.verify(req.password, pwd_hash):
+            raise HTTPException(status_code=401, detail="用户名或密码错误")
 
+        token, expires_at = session_signer.issue(str(user_id), req.username)
         return {
             "user_id": str(user_id),
-            "username": req.username
+            "username": req.username,
+            "token": token,
+            "expires_at": expires_at
         }
 
     except HTTPException:
         raise
+    except AuthBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"登录异常: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="登录失败")
 
+@app.post("/admin/reload-index")
+async def reload_index(x_admin_token: Optional[str] = Header(default=None), dependencies: Tuple[any, any] = Depends(get_dependencies)):
+    if not Config.ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", Config.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="无权限")
+
+    _, tool_config = dependencies
+    # 加载新索引耗时较长，放到线程中执行，期间请求继续使用旧版本
+    reloaded = await asyncio.to_thread(tool_config.index_registry.reload, True)
+    current = tool_config.index_registry.current
+    logger.info(f"手动热加载索引: {reloaded}, 当前版本: {current.version if current else None}")
+    return {"reloaded": reloaded, "version": current.version if current else None}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标：请求、节点、工具、检查点与记忆存储的耗时直方图，LLM token 与重试计数，连接池状态"""
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest, dependencies: Tuple[any, any] = Depends(get_dependencies)):
+async def chat_completions(request: ChatCompletionRequest, http_request: Request, dependencies: Tuple[any, any] = Depends(get_dependencies),
+                           authorization: Optional[str] = Header(default=None)):
+    # 本次请求的日志都带上同一个请求 ID，客户端可通过 X-Request-ID 传入
+    request_id_var.set(http_request.headers.get("x-request-id") or uuid.uuid4().hex[:16])
+
+    # 携带有效会话令牌时以令牌中的用户为准，只做一次 HMAC 校验，不访问数据库；
+    # 未开启 REQUIRE_SESSION 时，无法校验的令牌（如 OpenAI 兼容客户端附带的 API key）按匿名处理，沿用 request.userId
+    claims = None
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        claims = session_signer.verify(token) if scheme.lower() == "bearer" else None
+    if claims is not None:
+        request.userId = claims["uid"]
+    elif Config.REQUIRE_SESSION:
+        raise HTTPException(status_code=401, detail="会话令牌无效或已过期" if authorization else "请先登录")
+
     try:
         graph, tool_config = dependencies
         if not request.messages or not request.messages[-1].content:
@@ -388,13 +718,17 @@ async def chat_completions(request: ChatCompletionRequest, dependencies: Tuple[a
         }
 
         if request.stream:
-            return await handle_stream_response(user_input, graph, config)
-        return await handle_non_stream_response(user_input, graph, tool_config, config)
+            return await handle_stream_response(user_input, graph, tool_config, config, http_request)
+        with observe(REQUEST_LATENCY, "request", mode="non_stream"):
+            return await handle_non_stream_response(user_input, graph, tool_config, config)
 
     except Exception as e:
         logger.error(f"处理请求时发生错误: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 if __name__ == "__main__":
+    # psycopg 异步连接在 Windows 下需要 SelectorEventLoop
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     logger.info(f"Start the server on port {Config.PORT}")
     uvicorn.run(app, host=Config.HOST, port=Config.PORT)
@@ -0,0 +1,123 @@
+import time
+import asyncio
+from typing import Optional
+from psycopg_pool import AsyncConnectionPool
+from utils.index_registry import index_version
+from utils.log import Logger
+
+logger = Logger()
+
+def _to_vector(embedding: list[float]) -> str:
+    # 以 pgvector 文本格式传参，无需额外安装 pgvector 的 Python 包
+    return "[" + ",".join(f"{x:.7g}" for x in embedding) + "]"
+
+class AnswerCache:
+    """基于 pgvector 的语义答案缓存：问题向量与历史问题余弦相似度超过阈值时直接返回历史答案。
+
+    每条缓存记录当时的索引版本号，索引切换后旧版本的答案会在下次查询时被清除，
+    也可以调用 invalidate() 主动清空。版本号取 index_registry 已加载的版本，不必每次查询都扫描 faiss_db；
+    超过 ttl 的记录每隔 purge_interval 秒删除一次。
+    """
+
+    def __init__(self, conn_pool: AsyncConnectionPool, embed, threshold: float = 0.95, ttl: int = 7 * 24 * 3600,
+                 dims: int = 1024, db_path: str = "faiss_db", index_registry=None, purge_interval: float = 3600):
+        self.conn_pool = conn_pool
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dims = dims
+        self.db_path = db_path
+        self.index_registry = index_registry
+        self.purge_interval = purge_interval
+        self.purged_at = 0.0
+        self.version = None
+
+    async def setup(self):
+        async with self.conn_pool.connection() as conn:
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    id BIGSERIAL PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    embedding vector({self.dims}) NOT NULL,
+                    index_version TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS answer_cache_embedding_idx ON answer_cache USING hnsw (embedding vector_cosine_ops)"
+            )
+            await conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_created_at_idx ON answer_cache (created_at)")
+        await self.check_index_version()
+
+    async def current_version(self) -> str:
+        current = self.index_registry.current if self.index_registry else None
+        if current:
+            return current.version
+        # 没有注册表或索引未加载时才扫描目录，放到线程中执行
+        return await asyncio.to_thread(index_version, self.db_path)
+
+    async def check_index_version(self):
+        """索引版本变化时清除旧版本的答案，并定期删除超过有效期的记录"""
+        current = await self.current_version()
+        purge = time.monotonic() - self.purged_at >= self.purge_interval
+        if current == self.version and not purge:
+            return
+        async with self.conn_pool.connection() as conn:
+            if current != self.version:
+                cur = await conn.execute("DELETE FROM answer_cache WHERE index_version <> %s", (current,))
+                if cur.rowcount:
+                    logger.info(f"索引版本变为 {current}，已清除 {cur.rowcount} 条过期答案缓存")
+                self.version = current
+            if purge:
+                self.purged_at = time.monotonic()
+                cur = await conn.execute(
+                    "DELETE FROM answer_cache WHERE created_at < now() - make_interval(secs => %s)", (self.ttl,)
+                )
+                if cur.rowcount:
+                    logger.info(f"已删除 {cur.rowcount} 条超过有效期的答案缓存")
+
+    async def invalidate(self):
+        """清空全部答案缓存，供索引重建或热更新后调用"""
+        async with self.conn_pool.connection() as conn:
+            await conn.execute("TRUNCATE answer_cache")
+        self.version = await self.current_version()
+        logger.info("答案缓存已清空")
+
+    async def lookup(self, question: str) -> Optional[str]:
+        try:
+            await self.check_index_version()
+            vector = _to_vector(await self.embed.aembed_query(question))
+            async with self.conn_pool.connection() as conn:
+                cur = await conn.execute(
+                    """
+                    SELECT answer, 1 - (embedding <=> %s::vector) AS similarity
+                    FROM answer_cache
+                    WHERE index_version = %s AND created_at > now() - make_interval(secs => %s)
+                    ORDER BY embedding <=> %s::vector
+                    LIMIT 1
+                    """,
+                    (vector, self.version, self.ttl, vector)
+                )
+                row = await cur.fetchone()
+
+            if row and row[1] >= self.threshold:
+                logger.info(f"答案缓存命中，相似度: {row[1]:.4f}")
+                return row[0]
+            return None
+
+        except Exception as e:
+            logger.error(f"查询答案缓存时发生错误: {e}")
+            return None
+
+    async def put(self, question: str, answer: str):
+        try:
+            vector = _to_vector(await self.embed.aembed_query(question))
+            async with self.conn_pool.connection() as conn:
+                await conn.execute(
+                    "INSERT INTO answer_cache (question, answer, embedding, index_version) VALUES (%s, %s, %s::vector, %s)",
+                    (question, answer, vector, self.version or await self.current_version())
+                )
+        except Exception as e:
+            logger.error(f"写入答案缓存时发生错误: {e}")
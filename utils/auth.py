@@ -0,0 +1,124 @@
+import hmac
+import time
+import json
+import base64
+import asyncio
+import hashlib
+import secrets
+import threading
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from prometheus_client import Counter, Gauge, Histogram
+from utils.log import Logger
+
+logger = Logger()
+
+AUTH_QUEUE = Gauge("rag_auth_pending", "排队与执行中的密码哈希任务数")
+AUTH_REJECTED = Counter("rag_auth_rejected_total", "哈希队列已满被拒绝的请求数", ["operation"])
+AUTH_WAIT = Histogram("rag_auth_wait_seconds", "哈希任务排队等待时间", ["operation"],
+                      buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+AUTH_DURATION = Histogram("rag_auth_hash_seconds", "bcrypt 哈希与校验耗时", ["operation"],
+                          buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2))
+
+class AuthBusyError(Exception):
+    """哈希队列已满，调用方应返回 503 让客户端稍后重试"""
+    pass
+
+class PasswordHasher:
+    """bcrypt 哈希与校验在独立的定长线程池中执行。
+
+    - 与 uvicorn 默认线程池隔离，登录高峰不会拖慢其他同步调用
+    - 排队加执行中的任务超过 max_pending 时直接拒绝，而不是无限排队拉长所有人的延迟
+    - stats() 与 /metrics 提供排队数、拒绝数、等待时间与哈希耗时
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _timed(self, operation: str, submitted: float, fn, *args):
+        started = time.perf_counter()
+        AUTH_WAIT.labels(operation=operation).observe(started - submitted)
+        try:
+            return fn(*args)
+        finally:
+            AUTH_DURATION.labels(operation=operation).observe(time.perf_counter() - started)
+
+    async def _run(self, operation: str, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                AUTH_REJECTED.labels(operation=operation).inc()
+                raise AuthBusyError("认证请求过多，请稍后重试")
+            self.pending += 1
+            AUTH_QUEUE.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, self._timed, operation, time.perf_counter(), fn, *args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+            AUTH_QUEUE.dec()
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run("verify", self.context.verify, password, password_hash)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"pending": self.pending, "completed": self.completed, "rejected": self.rejected,
+                    "max_pending": self.max_pending}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+class SessionSigner:
+    """无状态会话令牌：base64url(载荷).base64url(HMAC-SHA256)，校验只需一次 HMAC，不访问数据库。
+    令牌在过期前一直有效，修改密钥即可使全部令牌失效。
+    """
+
+    def __init__(self, secret: str = "", ttl: int = 7 * 24 * 3600):
+        if not secret:
+            # 未配置密钥时每个进程随机生成，重启或多个 worker 之间令牌互不认可
+            logger.warning("未配置 SESSION_SECRET，使用随机密钥，服务重启后需重新登录")
+            secret = secrets.token_urlsafe(32)
+        self.key = secret.encode("utf-8")
+        self.ttl = ttl
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self.key, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, user_id: str, username: str) -> tuple[str, int]:
+        """返回 (令牌, 过期时间戳)"""
+        expires = int(time.time()) + self.ttl
+        payload = _b64encode(json.dumps({"uid": user_id, "usr": username, "exp": expires},
+                                        ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        return f"{payload}.{self._sign(payload)}", expires
+
+    def verify(self, token: str) -> Optional[dict]:
+        """令牌有效时返回载荷，签名错误、格式错误或已过期时返回 None"""
+        try:
+            payload, signature = token.split(".", 1)
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, UnicodeError):
+            return None
+        if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+            return None
+        return claims
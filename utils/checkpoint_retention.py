@@ -0,0 +1,257 @@
+import asyncio
+import argparse
+import threading
+from collections import defaultdict
+from typing import Optional
+from prometheus_client import Counter
+from psycopg_pool import AsyncConnectionPool
+from utils.log import Logger
+
+logger = Logger()
+
+RECLAIMED_ROWS = Counter("rag_checkpoint_reclaimed_rows_total", "检查点清理删除的行数", ["table"])
+RECLAIMED_BYTES = Counter("rag_checkpoint_reclaimed_bytes_total", "检查点清理删除的行大小（pg_column_size）", ["table"])
+
+# 同一数据库上多个 API worker 只让一个执行清理
+_LOCK_KEY = "checkpoint_retention"
+
+# 会话长时间无新检查点：以最新检查点的 ts 判断
+_IDLE_THREADS_SQL = """
+    SELECT thread_id FROM checkpoints
+    GROUP BY thread_id
+    HAVING max((checkpoint->>'ts')::timestamptz) < now() - make_interval(secs => %s)
+    LIMIT %s
+"""
+
+# 删除时再次确认仍然空闲，清理期间恰好收到新消息的会话不受影响
+_DELETE_IDLE_CHECKPOINTS_SQL = """
+    WITH idle AS (
+        SELECT thread_id FROM checkpoints
+        WHERE thread_id = ANY(%s)
+        GROUP BY thread_id
+        HAVING max((checkpoint->>'ts')::timestamptz) < now() - make_interval(secs => %s)
+    ), deleted AS (
+        DELETE FROM checkpoints c USING idle
+        WHERE c.thread_id = idle.thread_id
+        RETURNING pg_column_size(c.*) AS size
+    )
+    SELECT count(*), coalesce(sum(size), 0) FROM deleted
+"""
+
+_DELETE_THREAD_ROWS_SQL = """
+    WITH deleted AS (
+        DELETE FROM {table} t
+        WHERE t.thread_id = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM checkpoints c WHERE c.thread_id = t.thread_id)
+        RETURNING pg_column_size(t.*) AS size
+    )
+    SELECT count(*), coalesce(sum(size), 0) FROM deleted
+"""
+
+# 每个 (thread_id, checkpoint_ns) 只保留最新的 N 个检查点，checkpoint_id 为按时间递增的 uuid6
+_DELETE_OLD_CHECKPOINTS_SQL = """
+    WITH ranked AS (
+        SELECT thread_id, checkpoint_ns, checkpoint_id,
+               row_number() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+        FROM checkpoints
+    ), victims AS (
+        SELECT thread_id, checkpoint_ns, checkpoint_id FROM ranked WHERE rn > %s LIMIT %s
+    ), deleted AS (
+        DELETE FROM checkpoints c USING victims v
+        WHERE c.thread_id = v.thread_id AND c.checkpoint_ns = v.checkpoint_ns AND c.checkpoint_id = v.checkpoint_id
+        RETURNING pg_column_size(c.*) AS size
+    )
+    SELECT count(*), coalesce(sum(size), 0) FROM deleted
+"""
+
+# 所属检查点已删除的 pending writes；只处理比会话最新检查点更早的，避免误删正在写入的
+_DELETE_ORPHAN_WRITES_SQL = """
+    WITH victims AS (
+        SELECT w.ctid FROM checkpoint_writes w
+        WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id
+        ) AND EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = w.thread_id AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id > w.checkpoint_id
+        )
+        LIMIT %s
+    ), deleted AS (
+        DELETE FROM checkpoint_writes w USING victims v WHERE w.ctid = v.ctid
+        RETURNING pg_column_size(w.*) AS size
+    )
+    SELECT count(*), coalesce(sum(size), 0) FROM deleted
+"""
+
+# 没有任何检查点引用的通道值。aput 先写 blob 再写检查点，且两者不在同一事务中，
+# 只删除版本低于现存检查点所引用版本的 blob，刚写入、检查点尚未提交的新版本不会被删除
+_DELETE_ORPHAN_BLOBS_SQL = """
+    WITH victims AS (
+        SELECT b.ctid FROM checkpoint_blobs b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+              AND c.checkpoint->'channel_versions'->>b.channel = b.version
+        ) AND EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+              AND c.checkpoint->'channel_versions'->>b.channel > b.version
+        )
+        LIMIT %s
+    ), deleted AS (
+        DELETE FROM checkpoint_blobs b USING victims v WHERE b.ctid = v.ctid
+        RETURNING pg_column_size(b.*) AS size
+    )
+    SELECT count(*), coalesce(sum(size), 0) FROM deleted
+"""
+
+class CheckpointRetention:
+    """PostgresSaver 检查点清理。
+
+    - 每个会话只保留最新的 keep_latest 个检查点（对话内容在最新检查点的通道值中，不受影响）
+    - 超过 idle_ttl 秒没有新检查点的会话整体删除
+    - 删除失去引用的 checkpoint_blobs 与 checkpoint_writes
+    - 每条 DELETE 最多 batch_size 行，批次之间让出连接；多个 worker 通过 advisory lock 保证同时只有一个在清理
+    - 报告删除的行数与字节数（pg_column_size 之和，磁盘空间由 autovacuum 回收后复用）
+    """
+
+    def __init__(self, conn_pool: AsyncConnectionPool, keep_latest: int = 20, idle_ttl: float = 30 * 86400,
+                 batch_size: int = 500, pause: float = 0.05):
+        if keep_latest < 1:
+            raise ValueError("keep_latest 至少为 1，否则会删除会话当前状态")
+        self.conn_pool = conn_pool
+        self.keep_latest = keep_latest
+        self.idle_ttl = idle_ttl
+        self.batch_size = batch_size
+        self.pause = pause
+        self.task: Optional[asyncio.Task] = None
+        self.stopping: Optional[asyncio.Event] = None
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: {"rows": 0, "bytes": 0})
+        self.runs = 0
+
+    async def _delete(self, conn, table: str, sql: str, params: tuple, report: dict) -> int:
+        cur = await conn.execute(sql, params)
+        rows, size = await cur.fetchone()
+        if rows:
+            report[table]["rows"] += rows
+            report[table]["bytes"] += int(size)
+            RECLAIMED_ROWS.labels(table=table).inc(rows)
+            RECLAIMED_BYTES.labels(table=table).inc(int(size))
+            await asyncio.sleep(self.pause)
+        return rows
+
+    def _stop_requested(self) -> bool:
+        return self.stopping is not None and self.stopping.is_set()
+
+    async def _drain(self, conn, table: str, sql: str, params: tuple, report: dict):
+        while not self._stop_requested():
+            if await self._delete(conn, table, sql, params, report) < self.batch_size:
+                return
+
+    async def _expire_idle_threads(self, conn, report: dict) -> int:
+        expired = 0
+        while not self._stop_requested():
+            cur = await conn.execute(_IDLE_THREADS_SQL, (self.idle_ttl, self.batch_size))
+            thread_ids = [row[0] for row in await cur.fetchall()]
+            if not thread_ids:
+                return expired
+            await self._delete(conn, "checkpoints", _DELETE_IDLE_CHECKPOINTS_SQL, (thread_ids, self.idle_ttl), report)
+            for table in ("checkpoint_blobs", "checkpoint_writes"):
+                await self._drain(conn, table, _DELETE_THREAD_ROWS_SQL.format(table=table), (thread_ids,), report)
+            expired += len(thread_ids)
+            if len(thread_ids) < self.batch_size:
+                return expired
+        return expired
+
+    async def run_once(self) -> Optional[dict]:
+        """执行一轮清理，返回各表删除的行数与字节数；其他 worker 正在清理时返回 None"""
+        report = defaultdict(lambda: {"rows": 0, "bytes": 0})
+        async with self.conn_pool.connection() as conn:
+            cur = await conn.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (_LOCK_KEY,))
+            if not (await cur.fetchone())[0]:
+                logger.info("其他进程正在清理检查点，跳过本轮")
+                return None
+            try:
+                expired = 0
+                if self.idle_ttl > 0:
+                    expired = await self._expire_idle_threads(conn, report)
+                await self._drain(conn, "checkpoints", _DELETE_OLD_CHECKPOINTS_SQL, (self.keep_latest, self.batch_size), report)
+                await self._drain(conn, "checkpoint_writes", _DELETE_ORPHAN_WRITES_SQL, (self.batch_size,), report)
+                await self._drain(conn, "checkpoint_blobs", _DELETE_ORPHAN_BLOBS_SQL, (self.batch_size,), report)
+            finally:
+                try:
+                    await conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", (_LOCK_KEY,))
+                except BaseException:
+                    # 释放失败时关闭连接，会话级锁随连接一起释放，不会留在连接池里
+                    await conn.close()
+                    raise
+
+        result = {
+            "expired_threads": expired,
+            "tables": {table: dict(value) for table, value in report.items()},
+            "rows": sum(value["rows"] for value in report.values()),
+            "bytes": sum(value["bytes"] for value in report.values()),
+        }
+        with self.lock:
+            self.runs += 1
+            for table, value in report.items():
+                self.totals[table]["rows"] += value["rows"]
+                self.totals[table]["bytes"] += value["bytes"]
+        logger.info(f"检查点清理完成: 过期会话 {expired} 个，删除 {result['rows']} 行，约 {result['bytes'] / 1024 / 1024:.2f} MB，明细 {result['tables']}")
+        return result
+
+    async def _loop(self, interval: float):
+        while not self.stopping.is_set():
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"检查点清理时发生错误: {e}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, interval: float) -> asyncio.Task:
+        """在事件循环中以后台任务定期清理"""
+        self.stopping = asyncio.Event()
+        self.task = asyncio.create_task(self._loop(interval))
+        return self.task
+
+    async def stop(self, timeout: float = 10):
+        """在批次之间停止；不直接取消任务，避免查询执行到一半被打断后连接卡在 ACTIVE 状态"""
+        if self.task:
+            self.stopping.set()
+            done, _ = await asyncio.wait([self.task], timeout=timeout)
+            if not done:
+                self.task.cancel()
+                await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"runs": self.runs, "tables": {table: dict(value) for table, value in self.totals.items()}}
+
+async def _main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="清理 PostgresSaver 检查点")
+    parser.add_argument("--keep", type=int, default=Config.CHECKPOINT_KEEP_LATEST)
+    parser.add_argument("--idle-days", type=float, default=Config.CHECKPOINT_IDLE_TTL / 86400)
+    parser.add_argument("--batch-size", type=int, default=Config.CHECKPOINT_RETENTION_BATCH)
+    args = parser.parse_args()
+
+    async with AsyncConnectionPool(Config.DB_URI, kwargs={"autocommit": True, "prepare_threshold": 0}, open=False) as pool:
+        retention = CheckpointRetention(pool, keep_latest=args.keep, idle_ttl=args.idle_days * 86400,
+                                        batch_size=args.batch_size)
+        result = await retention.run_once()
+    if result is None:
+        print("其他进程正在清理检查点")
+        return
+    print(f"过期会话: {result['expired_threads']}")
+    for table, value in result["tables"].items():
+        print(f"  {table:<20}{value['rows']:>10} 行{value['bytes'] / 1024:>12.1f} KB")
+    print(f"合计: {result['rows']} 行，{result['bytes'] / 1024 / 1024:.2f} MB")
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,118 @@
+import re
+import threading
+from collections import defaultdict
+from utils.log import Logger
+
+logger = Logger()
+
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约 1.4 字一个 token，其余字符约 4 个一个 token。
+    只用于预算与前后对比，不需要与计费口径完全一致。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return int(cjk / 1.4 + (len(text) - cjk) / 4) + 1
+
+def trim_overlap(previous: str, text: str, max_overlap: int = 200, min_overlap: int = 10) -> str:
+    """去掉 text 开头与 previous 结尾重复的部分（分块时相邻片段有 chunk_overlap 个字符重叠）"""
+    previous, text = previous.rstrip(), text.lstrip()
+    for size in range(min(max_overlap, len(previous), len(text)), min_overlap - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+def dedup_chunks(docs: list) -> list[str]:
+    """按检索顺序返回各片段文本，同一篇同一字段的前一段排在它前面时，去掉与其重叠的开头。
+
+    前一段排在后面时不去重，否则重叠的文字会出现在后文，或随前一段一起被 fit_budget 丢掉；
+    fit_budget 按顺序保留前缀，去过重的片段被保留时，排在它前面的前一段一定也完整保留
+    """
+    seen = {}
+    texts = []
+    for doc in docs:
+        meta = doc.metadata
+        seg = meta.get("段号")
+        previous = seen.get((meta.get("篇名"), meta.get("字段"), seg - 1)) if isinstance(seg, int) else None
+        texts.append(trim_overlap(previous.page_content, doc.page_content) if previous else doc.page_content.strip())
+        seen[(meta.get("篇名"), meta.get("字段"), seg)] = doc
+    return texts
+
+def fit_budget(parts: list[str], budget: int, min_tail: int = 50) -> list[str]:
+    """按顺序保留片段直到用完 token 预算，最后一个放不下的片段剩余预算足够时截断保留"""
+    if budget <= 0:
+        return parts
+    kept, used = [], 0
+    for part in parts:
+        cost = estimate_tokens(part)
+        if used + cost <= budget:
+            kept.append(part)
+            used += cost
+            continue
+        remaining = budget - used
+        if remaining >= min_tail:
+            # 按比例换算成字符数截断
+            kept.append(part[:max(1, int(len(part) * remaining / cost))] + "……")
+        break
+    return kept
+
+def render_history(messages: list) -> str:
+    return "\n".join(f"{'用户' if m.type == 'human' else '助手'}: {m.content}" for m in messages)
+
+def compact_history(messages: list, keep: int = 2, summary_chars: int = 60) -> str:
+    """最近 keep 条消息原样保留，更早的轮次压缩为摘要：用户问题完整保留，助手回答只保留开头"""
+    messages = [m for m in messages if isinstance(m.content, str) and m.content.strip()]
+    if len(messages) <= keep:
+        return render_history(messages)
+
+    older, recent = messages[:-keep], messages[-keep:] if keep else []
+    lines = []
+    for m in older:
+        content = " ".join(m.content.split())
+        if m.type == "human":
+            lines.append(f"用户: {content}")
+        else:
+            lines.append(f"助手: {content[:summary_chars]}{'……' if len(content) > summary_chars else ''}")
+    summary = "【较早对话摘要】\n" + "\n".join(lines)
+    return summary + ("\n" + render_history(recent) if recent else "")
+
+def stale_messages(messages: list, max_messages: int = 0) -> list:
+    """返回会话状态中可以删除的消息，每轮结束时调用。
+
+    每轮只保留用户问题与最终回答，工具调用、工具输出、重写结果等中间消息全部删除；
+    max_messages 大于 0 时只保留最近的若干条问答，超出窗口的更早消息也一并删除
+    """
+    kept, stale = [], []
+    for i, m in enumerate(messages):
+        final = m.type == "ai" and not getattr(m, "tool_calls", None) and (i == len(messages) - 1 or messages[i + 1].type == "human")
+        (kept if m.type == "human" or final else stale).append(m)
+    if max_messages > 0 and len(kept) > max_messages:
+        stale.extend(kept[:-max_messages])
+    return [m for m in stale if m.id]
+
+class TokenReport:
+    """记录各节点压缩前后的输入 token 估算值"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: {"calls": 0, "before": 0, "after": 0})
+
+    def record(self, node: str, before: int, after: int):
+        with self.lock:
+            total = self.totals[node]
+            total["calls"] += 1
+            total["before"] += before
+            total["after"] += after
+        saved = 1 - after / before if before else 0.0
+        logger.info(f"{node} 输入 token 估算: 压缩前 {before}，压缩后 {after}，节省 {saved:.1%}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                node: {**total, "saved_rate": round(1 - total["after"] / total["before"], 4) if total["before"] else 0.0}
+                for node, total in self.totals.items()
+            }
+
+token_report = TokenReport()
@@ -0,0 +1,226 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from utils.log import Logger
+
+logger = Logger()
+
+def normalize_text(text: str) -> str:
+    """统一全角/半角并压缩空白，使同一问题的不同写法命中同一缓存项"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+class _DiskTier:
+    """基于 sqlite 的持久化缓存层，跨进程重启保留嵌入结果；条目超过 ttl 秒失效，最多保留 max_rows 条"""
+
+    # 每写入若干批清理一次过期与超出上限的条目
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, ttl: float, max_rows: int = 100000):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embed_cache (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embed_cache_created_at ON embed_cache (created_at)")
+        self.conn.commit()
+        with self.lock:
+            self._prune()
+
+    def _prune(self):
+        expired = self.conn.execute("DELETE FROM embed_cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+        evicted = 0
+        if self.max_rows > 0:
+            evicted = self.conn.execute(
+                "DELETE FROM embed_cache WHERE key IN (SELECT key FROM embed_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,)
+            ).rowcount
+        self.conn.commit()
+        if expired or evicted:
+            logger.info(f"嵌入持久化缓存清理：过期 {expired} 条，超出上限 {evicted} 条")
+
+    def get_many(self, keys: list[str]) -> dict:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embed_cache WHERE key IN ({placeholders}) AND created_at >= ?",
+                [*keys, time.time() - self.ttl]
+            ).fetchall()
+        return {key: array("f", blob).tolist() for key, blob in rows}
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embed_cache (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            self.conn.commit()
+            self.writes += 1
+            if self.writes % self.PRUNE_EVERY == 0:
+                self._prune()
+
+class CachedEmbeddings(Embeddings):
+    """带缓存的嵌入包装器，放在 Config.embed1 前面，供 FAISS 检索与 PostgresStore 记忆共用。
+
+    - 进程内 LRU，容量 maxsize，条目超过 ttl 秒失效
+    - 可选 sqlite 持久层（persist_path），键为 (模型名, 规范化文本)，同样按 ttl 失效，最多 persist_max_rows 条；
+      异步接口在线程中读写持久层，不阻塞事件循环
+    - hits / misses / disk_hits 计数，stats() 返回命中率
+    """
+
+    def __init__(self, embed: Embeddings, model: str = None, maxsize: int = 2048, ttl: float = 24 * 3600, persist_path: str = None,
+                 persist_max_rows: int = 100000):
+        self.embed = embed
+        self.model = model or getattr(embed, "model", embed.__class__.__name__)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.disk = None
+        if persist_path:
+            try:
+                self.disk = _DiskTier(persist_path, ttl, persist_max_rows)
+            except Exception as e:
+                logger.error(f"嵌入持久化缓存初始化失败，仅使用内存缓存: {e}")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model}:{digest}"
+
+    def _get(self, key: str):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        vector, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return vector
+
+    def _set(self, key: str, vector: list[float]):
+        self.cache[key] = (vector, time.monotonic() + self.ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    def _lookup_memory(self, texts: list[str]) -> tuple[list, list[str]]:
+        keys = [self._key(t) for t in texts]
+        with self.lock:
+            results = [self._get(key) for key in keys]
+        return results, keys
+
+    def _lookup_disk(self, results: list, keys: list[str]):
+        """用持久层补全内存层未命中的结果（阻塞 I/O）"""
+        pending = [i for i, v in enumerate(results) if v is None]
+        if not pending:
+            return
+        try:
+            found = self.disk.get_many(list({keys[i] for i in pending}))
+        except Exception as e:
+            logger.error(f"读取嵌入持久化缓存失败: {e}")
+            return
+        with self.lock:
+            for i in pending:
+                if keys[i] in found:
+                    results[i] = found[keys[i]]
+                    self._set(keys[i], results[i])
+                    self.disk_hits += 1
+
+    def _missing(self, results: list) -> list[int]:
+        missing = [i for i, v in enumerate(results) if v is None]
+        with self.lock:
+            self.hits += len(results) - len(missing)
+            self.misses += len(missing)
+        return missing
+
+    def _lookup(self, texts: list[str]) -> tuple[list, list[str], list[int]]:
+        """查询内存层与持久层，返回 (结果列表, 各文本的键, 未命中的下标)"""
+        results, keys = self._lookup_memory(texts)
+        if self.disk:
+            self._lookup_disk(results, keys)
+        return results, keys, self._missing(results)
+
+    async def _alookup(self, texts: list[str]) -> tuple[list, list[str], list[int]]:
+        results, keys = self._lookup_memory(texts)
+        if self.disk and None in results:
+            await asyncio.to_thread(self._lookup_disk, results, keys)
+        return results, keys, self._missing(results)
+
+    def _store(self, results: list, keys: list[str], missing: list[int], vectors: list[list[float]]) -> dict:
+        """写入内存层，返回需要写入持久层的新结果"""
+        fresh = {}
+        with self.lock:
+            for i, vector in zip(missing, vectors):
+                results[i] = vector
+                self._set(keys[i], vector)
+                fresh[keys[i]] = vector
+        return fresh
+
+    def _persist(self, fresh: dict):
+        if not self.disk:
+            return
+        try:
+            self.disk.put_many(fresh)
+        except Exception as e:
+            logger.error(f"写入嵌入持久化缓存失败: {e}")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        results, keys, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embed.embed_documents([texts[i] for i in missing])
+            self._persist(self._store(results, keys, missing, vectors))
+        return results
+
+    def embed_query(self, text: str) -> list[float]:
+        results, keys, missing = self._lookup([text])
+        if missing:
+            self._persist(self._store(results, keys, missing, [self.embed.embed_query(text)]))
+        return results[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        results, keys, missing = await self._alookup(texts)
+        if missing:
+            vectors = await self.embed.aembed_documents([texts[i] for i in missing])
+            fresh = self._store(results, keys, missing, vectors)
+            if self.disk:
+                await asyncio.to_thread(self._persist, fresh)
+        return results
+
+    async def aembed_query(self, text: str) -> list[float]:
+        results, keys, missing = await self._alookup([text])
+        if missing:
+            fresh = self._store(results, keys, missing, [await self.embed.aembed_query(text)])
+            if self.disk:
+                await asyncio.to_thread(self._persist, fresh)
+        return results[0]
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self.cache),
+                "hit_rate": self.hits / total if total else 0.0
+            }
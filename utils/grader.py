@@ -0,0 +1,116 @@
+import re
+import asyncio
+import threading
+from typing import Awaitable, Callable, Optional
+from utils.log import Logger
+
+logger = Logger()
+
+GRADE_MODES = ("llm", "local", "hybrid")
+GRADE_SIGNALS = ("score", "lexical", "cross_encoder")
+
+# retriever_tool 的输出以 "\n\n【篇名 - 字段 第N段】" 分隔各个片段
+_CHUNK_SEP = re.compile(r"\n\n(?=【)")
+_NON_WORD = re.compile(r"[\W_]+")
+
+def lexical_overlap(question: str, context: str) -> float:
+    """问题的字符二元组在检索文本中出现的比例，中文不分词也能近似衡量词面重合度"""
+    q = _NON_WORD.sub("", question)
+    c = _NON_WORD.sub("", context)
+    grams = {q[i:i + 2] for i in range(len(q) - 1)} or set(q)
+    if not grams:
+        return 0.0
+    return sum(g in c for g in grams) / len(grams)
+
+class RelevanceGrader:
+    """可插拔的文档相关性评估器，输出与 LLM 评估相同的 "yes" / "no"。
+
+    mode:
+    - llm: 每次都调用 LLM（原有行为）
+    - local: 只用本地信号判定，分数 >= threshold 为 yes
+    - hybrid: 分数落在 threshold ± margin 的不确定区间时才调用 LLM
+
+    signal:
+    - score: retriever_tool 返回的 FAISS 余弦相似度（各片段取最大值）
+    - lexical: 问题与检索文本的字符二元组重合度
+    - cross_encoder: 本地 CrossEncoder 模型对 (问题, 片段) 打分，需安装 sentence-transformers
+    """
+
+    def __init__(self, mode: str = "hybrid", signal: str = "score", threshold: float = 0.55,
+                 margin: float = 0.1, cross_encoder_model: str = None):
+        if mode not in GRADE_MODES:
+            raise ValueError(f"未知的评估模式: {mode}，可选: {', '.join(GRADE_MODES)}")
+        if signal not in GRADE_SIGNALS:
+            raise ValueError(f"未知的评估信号: {signal}，可选: {', '.join(GRADE_SIGNALS)}")
+        self.mode = mode
+        self.signal = signal
+        self.threshold = threshold
+        self.margin = margin
+        self.cross_encoder = None
+        if mode != "llm" and signal == "cross_encoder":
+            self.cross_encoder = self._load_cross_encoder(cross_encoder_model)
+
+        self.lock = threading.Lock()
+        self.total = 0
+        self.llm_calls = 0
+
+    def _load_cross_encoder(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+            return CrossEncoder(model_name)
+        except Exception as e:
+            logger.error(f"加载 CrossEncoder 模型 {model_name} 失败，改用检索分数评估: {e}")
+            self.signal = "score"
+            return None
+
+    def _cross_encoder_score(self, question: str, chunks: list[str]) -> float:
+        # 单输出的 CrossEncoder 默认经过 sigmoid，分数在 0~1 之间
+        return float(max(self.cross_encoder.predict([(question, c) for c in chunks])))
+
+    async def local_score(self, question: str, context: str, scores: Optional[list[float]]) -> Optional[float]:
+        """计算本地相关性分数，无法计算时返回 None"""
+        if self.signal == "score":
+            return max(scores) if scores else None
+        if self.signal == "lexical":
+            return lexical_overlap(question, context)
+        chunks = [c for c in _CHUNK_SEP.split(context) if c.strip()]
+        if not chunks:
+            return None
+        # CrossEncoder 推理是 CPU 密集的阻塞调用，放到线程中执行，不阻塞其他请求的流式输出
+        return await asyncio.to_thread(self._cross_encoder_score, question, chunks)
+
+    async def grade(self, question: str, context: str, scores: Optional[list[float]],
+                    llm_grade: Callable[[], Awaitable[str]]) -> str:
+        score = None if self.mode == "llm" else await self.local_score(question, context, scores)
+
+        if score is None:
+            verdict, source = None, "LLM"
+        elif self.mode == "local":
+            verdict, source = ("yes" if score >= self.threshold else "no"), "本地"
+        elif score >= self.threshold + self.margin:
+            verdict, source = "yes", "本地"
+        elif score < self.threshold - self.margin:
+            verdict, source = "no", "本地"
+        else:
+            verdict, source = None, "LLM"
+
+        if verdict is None:
+            verdict = await llm_grade()
+        with self.lock:
+            self.total += 1
+            self.llm_calls += source == "LLM"
+        score_text = "无" if score is None else f"{score:.4f}"
+        logger.info(f"文档评估({self.signal}/{self.mode}): {verdict}，本地分数 {score_text}，判定来源 {source}")
+        return verdict
+
+    def stats(self) -> dict:
+        with self.lock:
+            avoided = self.total - self.llm_calls
+            return {
+                "mode": self.mode,
+                "signal": self.signal,
+                "total": self.total,
+                "llm_calls": self.llm_calls,
+                "llm_avoided": avoided,
+                "avoided_rate": round(avoided / self.total, 4) if self.total else 0.0,
+            }
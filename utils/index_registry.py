@@ -0,0 +1,151 @@
+import os
+import hashlib
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from utils.index_store import load_store
+from utils.retriever import MultiIndexRetriever
+from utils.log import Logger
+
+logger = Logger()
+
+def _is_transient(name: str) -> bool:
+    # 构建过程中的断点目录与原子替换用的临时目录不参与版本计算
+    return name.startswith(".") or name.endswith((".tmp", ".old"))
+
+def index_version(db_path: str = "faiss_db") -> str:
+    """根据 faiss_db 下索引文件的大小与修改时间生成版本号，索引重建后版本随之变化"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(db_path):
+        dirs[:] = sorted(d for d in dirs if not _is_transient(d))
+        for name in sorted(files):
+            if _is_transient(name):
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, db_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+class IndexVersion:
+    """一次加载得到的索引快照，引用计数归零且已被替换后释放内存"""
+
+    def __init__(self, version: str, stores: list, retriever: MultiIndexRetriever):
+        self.version = version
+        self.stores = stores
+        self.retriever = retriever
+        self.refs = 0
+        self.retired = False
+
+    def release(self):
+        self.stores = None
+        self.retriever = None
+        logger.info(f"索引版本 {self.version} 已释放")
+
+class IndexRegistry:
+    """版本化的 FAISS 索引注册表。
+
+    - reload() 在调用线程中加载新索引，加载完成后原子替换当前版本
+    - acquire() 借用当前版本；pin() 把一次请求固定在某个版本上，请求内多次检索结果一致
+    - 旧版本在所有借用归还后释放
+    - watch() 启动后台线程轮询 faiss_db 变化并自动 reload
+    """
+
+    def __init__(self, embed, db_path: str = "faiss_db", weights: list[float] = None, k: int = 3):
+        self.embed = embed
+        self.db_path = db_path
+        self.weights = weights or [0.2, 0.5, 0.3]
+        self.k = k
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.pinned = ContextVar(f"index_version_{id(self)}", default=None)
+        self.stop_event = threading.Event()
+        self.current: Optional[IndexVersion] = None
+        self.reload(force=True)
+
+    def _load(self, version: str) -> IndexVersion:
+        print("正在初始化工具：加载向量数据库...")
+        # 有紧凑格式时以 mmap 方式加载，否则回退到 FAISS.load_local
+        stores = [load_store(os.path.join(self.db_path, name), self.embed) for name in ("raw", "trans", "note")]
+        vector_raw, vector_trans, vector_note = stores
+        print("向量数据库加载成功！")
+        print(f"  原文向量数: {vector_raw.index.ntotal}")
+        print(f"  直译向量数: {vector_trans.index.ntotal}")
+        print(f"  解要向量数: {vector_note.index.ntotal}")
+
+        # 融合检索器只构建一次，每次查询只嵌入一次，权重：原文 0.2、直译 0.5、解要 0.3
+        retriever = MultiIndexRetriever(stores=stores, weights=self.weights, embed=self.embed, k=self.k)
+        return IndexVersion(version, stores, retriever)
+
+    def reload(self, force: bool = False) -> bool:
+        """加载 faiss_db 的最新内容并切换，版本未变化且非强制时直接返回 False"""
+        with self.reload_lock:
+            version = index_version(self.db_path)
+            if not force and self.current and self.current.version == version:
+                return False
+            try:
+                new = self._load(version)
+            except Exception as e:
+                print(f"警告：向量数据库加载失败，文档查询查询功能将不可用。错误: {e}")
+                logger.error(f"加载索引版本 {version} 失败: {e}")
+                return False
+
+            with self.lock:
+                old, self.current = self.current, new
+                if old:
+                    old.retired = True
+                    drained = old.refs == 0
+            if old and drained:
+                old.release()
+            logger.info(f"索引已切换到版本 {version}")
+            return True
+
+    @contextmanager
+    def acquire(self):
+        """借用当前请求固定的版本（没有则为最新版本），退出时归还"""
+        with self.lock:
+            current = self.pinned.get() or self.current
+            if current:
+                current.refs += 1
+        try:
+            yield current
+        finally:
+            if current:
+                with self.lock:
+                    current.refs -= 1
+                    drained = current.retired and current.refs == 0
+                if drained:
+                    current.release()
+
+    @contextmanager
+    def pin(self):
+        """把当前上下文（一次请求）固定到最新版本，请求结束前旧版本不会被释放"""
+        with self.acquire() as current:
+            token = self.pinned.set(current)
+            try:
+                yield current
+            finally:
+                self.pinned.reset(token)
+
+    def watch(self, interval: float = 30) -> threading.Thread:
+        """后台轮询索引目录，连续两次读到相同的新版本后才加载，避免读到构建中途的文件"""
+        def _watch():
+            seen = self.current.version if self.current else None
+            while not self.stop_event.wait(interval):
+                try:
+                    version = index_version(self.db_path)
+                    if self.current and version == self.current.version:
+                        seen = version
+                        continue
+                    if version == seen:
+                        self.reload()
+                    seen = version
+                except Exception as e:
+                    logger.error(f"检查索引变化时发生错误: {e}")
+
+        thread = threading.Thread(target=_watch, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
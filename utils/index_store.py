@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+from collections.abc import Mapping
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+# 紧凑格式文件名，与 FAISS.save_local 的 index.faiss / index.pkl 放在同一目录
+VECTORS_FILE = "vectors.faiss"
+DOCS_FILE = "docs.bin"
+OFFSETS_FILE = "docs.idx.npy"
+
+# IO_FLAG_MMAP_IFC 以 mmap 方式加载 IndexFlat / HNSW / SQ 的编码存储；
+# IVF 倒排表的 IO_FLAG_MMAP 不支持 read_index 的缓冲读取器，倒排表仍读入内存
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+class CompactDocstore(Docstore):
+    """只读的偏移索引文档库：所有分块按 FAISS 行号顺序以 JSON 记录拼接在 docs.bin 中，
+    docs.idx.npy 记录每条记录的起止偏移。两者都以 mmap 打开，按需读取，
+    多个 worker 进程通过页缓存共享同一份物理内存。
+    """
+
+    def __init__(self, path: str):
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        data_file = os.path.join(path, DOCS_FILE)
+        self.data = np.memmap(data_file, dtype=np.uint8, mode="r") if os.path.getsize(data_file) else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def search(self, search: str) -> Document:
+        row = int(search)
+        if not 0 <= row < len(self):
+            return f"ID {search} not found."
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        record = json.loads(bytes(self.data[start:end]).decode("utf-8"))
+        return Document(page_content=record["text"], metadata=record["metadata"], id=record["id"])
+
+class RowIds(Mapping):
+    """FAISS 行号到文档库 ID 的映射，紧凑格式中二者相同，无需常驻一个大字典"""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, row: int) -> str:
+        if not 0 <= row < self.size:
+            raise KeyError(row)
+        return str(row)
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+def has_compact(path: str) -> bool:
+    return all(os.path.exists(os.path.join(path, f)) for f in (VECTORS_FILE, DOCS_FILE, OFFSETS_FILE))
+
+def export_compact(store: FAISS, path: str):
+    """把 FAISS 向量库导出为紧凑格式：向量写入 vectors.faiss，文本与元数据按行号写入 docs.bin"""
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(store.index, os.path.join(path, VECTORS_FILE))
+
+    offsets = [0]
+    with open(os.path.join(path, DOCS_FILE), "wb") as f:
+        for row in range(store.index.ntotal):
+            doc_id = store.index_to_docstore_id[row]
+            doc = store.docstore.search(doc_id)
+            record = json.dumps(
+                {"id": doc_id, "text": doc.page_content, "metadata": doc.metadata},
+                ensure_ascii=False
+            ).encode("utf-8")
+            f.write(record)
+            offsets.append(offsets[-1] + len(record))
+    np.save(os.path.join(path, OFFSETS_FILE), np.asarray(offsets, dtype=np.uint64))
+
+def load_compact(path: str, embed) -> FAISS:
+    index = faiss.read_index(os.path.join(path, VECTORS_FILE), MMAP_FLAGS)
+    docstore = CompactDocstore(path)
+    if len(docstore) != index.ntotal:
+        raise ValueError(f"{path} 中向量数 {index.ntotal} 与文档数 {len(docstore)} 不一致")
+    return FAISS(embed, index, docstore, RowIds(index.ntotal))
+
+def load_store(path: str, embed) -> FAISS:
+    """优先加载紧凑格式，不存在时回退到 FAISS.load_local"""
+    if has_compact(path):
+        return load_compact(path, embed)
+    return FAISS.load_local(folder_path=path, embeddings=embed, allow_dangerous_deserialization=True)
+
+if __name__ == "__main__":
+    # 把已有的 faiss_db 转换为紧凑格式：python -m utils.index_store faiss_db
+    from langchain_core.embeddings import FakeEmbeddings
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "faiss_db"
+    for name in ("raw", "trans", "note"):
+        path = os.path.join(db_path, name)
+        store = FAISS.load_local(path, FakeEmbeddings(size=1), allow_dangerous_deserialization=True)
+        export_compact(store, path)
+        print(f"{path} 已导出紧凑格式，共 {store.index.ntotal} 条")
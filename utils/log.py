@@ -1,23 +1,85 @@
 from concurrent_log_handler import ConcurrentRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener
+from contextvars import ContextVar
+import os
+import json
+import queue
+import atexit
 import logging
+import threading
 
-def Logger():
+# 当前请求的 ID，由 API 入口设置；asyncio 任务与工具线程会复制上下文，同一请求的日志带相同 ID
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
 
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json：每行一个 JSON 对象；text：原有的纯文本格式
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+class RequestIdFilter(logging.Filter):
+    """在调用方线程中读取请求 ID，写入日志记录"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "name": record.name,
+            "module": record.module,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+_listener = None
+_lock = threading.Lock()
 
-    logger.handlers = []
+def _start_listener(logger: logging.Logger):
+    """日志先进入内存队列，由后台线程写文件，请求路径上不再有文件锁与磁盘写入"""
+    global _listener
     handler = ConcurrentRotatingFileHandler(
         filename="output/app.log",
         maxBytes=1024 * 1024 * 5,
         backupCount=3,
         encoding="utf-8"
     )
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    logger.handlers = [queue_handler]
+
+    _listener = QueueListener(log_queue, handler)
+    _listener.start()
+    # 进程退出时写完队列中剩余的日志
+    atexit.register(stop_logging)
+
+def stop_logging():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def Logger():
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOG_LEVEL)
 
-    handler.setLevel(logging.DEBUG)
-    handler.setFormatter(logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    ))
-    logger.addHandler(handler)
+    with _lock:
+        if _listener is None:
+            _start_listener(logger)
 
-    return logger
\ No newline at end of file
+    return logger
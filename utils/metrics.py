@@ -0,0 +1,180 @@
+import time
+import asyncio
+import logging
+import contextlib
+from functools import wraps
+from contextvars import ContextVar
+from prometheus_client import REGISTRY, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from utils.log import Logger
+
+logger = Logger()
+
+# 节点内的 LLM 重试、工具调用等据此归属到所在节点
+current_node: ContextVar[str] = ContextVar("current_node", default="-")
+
+# 覆盖从几毫秒的本地操作到数十秒的 LLM 调用
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_LATENCY = Histogram("rag_request_duration_seconds", "单次对话请求耗时", ["mode", "status"], buckets=LATENCY_BUCKETS)
+NODE_LATENCY = Histogram("rag_node_duration_seconds", "图节点执行耗时", ["node", "status"], buckets=LATENCY_BUCKETS)
+NODE_RETRIES = Counter("rag_node_retries_total", "问题重写后节点再次执行的次数", ["node"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM token 用量", ["node", "direction"])
+LLM_RETRIES = Counter("rag_llm_retries_total", "LLM 接口请求重试次数", ["node"])
+TOOL_LATENCY = Histogram("rag_tool_duration_seconds", "工具调用耗时", ["tool", "status"], buckets=LATENCY_BUCKETS)
+DB_LATENCY = Histogram("rag_db_operation_duration_seconds", "检查点与记忆存储操作耗时", ["component", "operation", "status"], buckets=LATENCY_BUCKETS)
+DB_RETRIES = Counter("rag_db_retries_total", "数据库连接测试重试次数", ["operation"])
+WEB_SEARCH_CACHE = Counter("rag_web_search_cache_total", "联网搜索缓存的命中、未命中与合并的并发请求数", ["result"])
+
+CHECKPOINT_OPERATIONS = ("aget_tuple", "aput", "aput_writes", "alist", "adelete_thread")
+STORE_OPERATIONS = ("aget", "asearch", "aput", "adelete", "alist_namespaces")
+
+_tracer = None
+
+def setup_tracing(service_name: str = "tcm-agentic-rag") -> bool:
+    """启用 OpenTelemetry span，需安装 opentelemetry-api；导出器与采样由 OTel SDK 或自动埋点按标准环境变量配置"""
+    global _tracer
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer(service_name)
+        logger.info("已启用 OpenTelemetry 追踪")
+        return True
+    except Exception as e:
+        logger.error(f"启用 OpenTelemetry 追踪失败，仅记录 Prometheus 指标: {e}")
+        _tracer = None
+        return False
+
+def span(name: str, **attributes):
+    if _tracer is None:
+        return contextlib.nullcontext()
+    return _tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None})
+
+@contextlib.contextmanager
+def observe(histogram: Histogram, span_name: str, **labels):
+    """计时并按是否抛出异常记录 status 标签，同时开启同名 span"""
+    status = "ok"
+    started = time.perf_counter()
+    try:
+        with span(span_name, **labels):
+            yield
+    except GeneratorExit:
+        # 调用方提前结束遍历（如 alist 只取第一条）
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        histogram.labels(**labels, status=status).observe(time.perf_counter() - started)
+
+def observe_node(name: str, node):
+    """包装图节点：记录耗时、所在节点与重写轮次中的再次执行。保留原签名，LangGraph 仍按需注入 config / store"""
+    @wraps(node)
+    async def wrapper(state, *args, **kwargs):
+        if state.get("rewrite_count") and name != "rewrite":
+            NODE_RETRIES.labels(node=name).inc()
+        token = current_node.set(name)
+        try:
+            with observe(NODE_LATENCY, f"node.{name}", node=name):
+                return await node(state, *args, **kwargs)
+        finally:
+            current_node.reset(token)
+    return wrapper
+
+def record_llm_usage(node: str, usage_metadata: dict):
+    """usage_metadata 为 get_usage_metadata_callback 按模型汇总的用量"""
+    for usage in usage_metadata.values():
+        LLM_TOKENS.labels(node=node, direction="input").inc(usage.get("input_tokens", 0))
+        LLM_TOKENS.labels(node=node, direction="output").inc(usage.get("output_tokens", 0))
+
+def instrument_db(target, component: str, operations: tuple) -> None:
+    """为检查点或记忆存储实例的异步方法计时，不改变类本身"""
+    for operation in operations:
+        method = getattr(target, operation, None)
+        if method is None:
+            continue
+
+        def _wrap(method, operation):
+            @wraps(method)
+            async def wrapper(*args, **kwargs):
+                with observe(DB_LATENCY, f"db.{component}.{operation}", component=component, operation=operation):
+                    return await method(*args, **kwargs)
+            return wrapper
+
+        # alist 是异步生成器，单独计时整个遍历过程
+        if operation == "alist":
+            def _wrap_gen(method, operation):
+                @wraps(method)
+                async def wrapper(*args, **kwargs):
+                    with observe(DB_LATENCY, f"db.{component}.{operation}", component=component, operation=operation):
+                        async for item in method(*args, **kwargs):
+                            yield item
+                return wrapper
+            setattr(target, operation, _wrap_gen(method, operation))
+        else:
+            setattr(target, operation, _wrap(method, operation))
+
+class LLMRetryHandler(logging.Handler):
+    """openai SDK 的重试只写一条 INFO 日志，据此计数并归属到当前节点"""
+
+    def emit(self, record: logging.LogRecord):
+        if record.getMessage().startswith("Retrying request"):
+            LLM_RETRIES.labels(node=current_node.get()).inc()
+
+def watch_llm_retries():
+    sdk_logger = logging.getLogger("openai._base_client")
+    if not any(isinstance(h, LLMRetryHandler) for h in sdk_logger.handlers):
+        sdk_logger.addHandler(LLMRetryHandler(level=logging.INFO))
+        if sdk_logger.getEffectiveLevel() > logging.INFO:
+            # 原本不输出 INFO 时只为计数而降低级别，不再向上传给其他 handler
+            sdk_logger.setLevel(logging.INFO)
+            sdk_logger.propagate = False
+
+class PoolCollector:
+    """抓取 /metrics 时读取连接池统计，取代原先定时写日志的连接池监控"""
+
+    GAUGES = ("pool_min", "pool_max", "pool_size", "pool_available", "requests_waiting")
+    COUNTERS = ("requests_num", "requests_queued", "requests_errors", "connections_num",
+                "connections_errors", "connections_lost", "returns_bad")
+
+    def __init__(self, conn_pool):
+        self.conn_pool = conn_pool
+
+    def collect(self):
+        if self.conn_pool is None or self.conn_pool.closed:
+            return
+        stats = self.conn_pool.get_stats()
+        for name in self.GAUGES:
+            gauge = GaugeMetricFamily(f"rag_db_{name}", f"连接池 {name}")
+            gauge.add_metric([], stats.get(name, 0))
+            yield gauge
+        active = GaugeMetricFamily("rag_db_pool_active", "连接池中正在使用的连接数")
+        active.add_metric([], stats.get("pool_size", 0) - stats.get("pool_available", 0))
+        yield active
+        for name in self.COUNTERS:
+            counter = CounterMetricFamily(f"rag_db_{name}", f"连接池累计 {name}")
+            counter.add_metric([], stats.get(name, 0))
+            yield counter
+        for name in ("requests_wait_ms", "usage_ms", "connections_ms"):
+            counter = CounterMetricFamily(f"rag_db_{name[:-3]}_seconds", f"连接池累计 {name[:-3]} 耗时")
+            counter.add_metric([], stats.get(name, 0) / 1000)
+            yield counter
+
+_pool_collector = None
+
+def register_pool(conn_pool) -> None:
+    global _pool_collector
+    unregister_pool()
+    _pool_collector = PoolCollector(conn_pool)
+    REGISTRY.register(_pool_collector)
+
+def unregister_pool() -> None:
+    global _pool_collector
+    if _pool_collector is not None:
+        REGISTRY.unregister(_pool_collector)
+        _pool_collector = None
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,24 +1,102 @@
-from paddleocr import PaddleOCR
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+import multiprocessing
+import argparse
+import hashlib
 import json
 import os
 
-ocr = PaddleOCR(
-    use_angle_cls=True,
-    lang="ch"
-)
+# 每个 OCR 进程各自持有一个 PaddleOCR 实例，在进程初始化时创建
+ocr = None
 
-def ocr_image(img_path):
-    result = ocr.predict(img_path)
-    lines = []
+def init_worker():
+    global ocr
+    from paddleocr import PaddleOCR
 
-    for res in result:
-        texts = res.get("rec_texts", [])
-        for t in texts:
+    ocr = PaddleOCR(
+        use_angle_cls=True,
+        lang="ch"
+    )
+
+def ocr_batch(img_paths):
+    """在当前进程的 PaddleOCR 实例上识别一批页面，按输入顺序返回每页的文本行"""
+    pages = []
+    for result in ocr.predict(img_paths):
+        lines = []
+        for t in result.get("rec_texts", []):
             if t.strip():
                 lines.append(t.strip())
-
-    return lines
+        pages.append(lines)
+
+    return pages
+
+class OcrCache:
+    """按图片内容哈希缓存每页的识别结果，解析规则调整后重跑无需再次 OCR"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def image_hash(img_path):
+        digest = hashlib.sha256()
+        with open(img_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, lines):
+        # 先写临时文件再替换，进程中断不会留下半个缓存文件
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(lines, f, ensure_ascii=False)
+        os.replace(tmp, self._path(key))
+
+def ocr_pages(img_paths, cache_dir="output/ocr_cache", workers=4, batch_size=8):
+    """多进程识别所有页面，结果按页码顺序逐页产出。
+
+    已缓存的页面直接读取缓存；其余页面按 batch_size 分批交给 workers 个进程，
+    每批识别完成后立即写入缓存。
+    """
+    cache = OcrCache(cache_dir)
+    keys = [cache.image_hash(p) for p in img_paths]
+    results = [cache.get(k) for k in keys]
+
+    pending = [i for i, r in enumerate(results) if r is None]
+    print(f"共 {len(img_paths)} 页，缓存命中 {len(img_paths) - len(pending)} 页，待识别 {len(pending)} 页")
+    if not pending:
+        yield from results
+        return
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    # PaddleOCR 不支持 fork 后复用，使用 spawn 启动进程
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(batches)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker
+    ) as executor:
+        # map 按提交顺序返回，前面的页面识别完即可交给状态机，无需等待全部完成
+        outputs = executor.map(ocr_batch, [[img_paths[i] for i in batch] for batch in batches])
+        next_page = 0
+        with tqdm(total=len(img_paths)) as bar:
+            for batch, pages in zip(batches, outputs):
+                for i, lines in zip(batch, pages):
+                    cache.put(keys[i], lines)
+                    results[i] = lines
+                while next_page < len(results) and results[next_page] is not None:
+                    yield results[next_page]
+                    next_page += 1
+                    bar.update(1)
 
 def is_pian_title(text):
     return "篇第" in text and len(text) < 25
@@ -32,51 +110,65 @@ def is_jieyao(text):
 def is_zhiyi(text):
     t = normalize(text)
     return t in ["廖冬晴直译", "【廖冬晴直译】", "〔廖冬晴直译〕"]
-data = []
-
-current = None
-section = None
-
-img_files = sorted(os.listdir("pages"))
-
-for img in tqdm(img_files):
-    lines = ocr_image(os.path.join("pages", img))
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        # 新篇
-        if is_pian_title(line):
-            if current:
-                data.append(current)
-            current = {
-                "篇名": line,
-                "原文": "",
-                "梅自强解要": "",
-                "廖冬晴直译": ""
-            }
-            section = "原文"
-            continue
-
-        if not current:
-            continue
-
-        if is_jieyao(line):
-            section = "梅自强解要"
-            continue
-
-        if is_zhiyi(line):
-            section = "廖冬晴直译"
-            continue
-
-        current[section] += line + "\n"
-
-# 最后一篇
-if current:
-    data.append(current)
-with open("huangdi_waijing.json", "w", encoding="utf-8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
-
-print(f"✅ 完成，共识别 {len(data)} 篇")
+
+def parse_pages(pages):
+    """按页码顺序把每页的文本行切分为 篇名 / 原文 / 梅自强解要 / 廖冬晴直译"""
+    data = []
+
+    current = None
+    section = None
+
+    for lines in pages:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            # 新篇
+            if is_pian_title(line):
+                if current:
+                    data.append(current)
+                current = {
+                    "篇名": line,
+                    "原文": "",
+                    "梅自强解要": "",
+                    "廖冬晴直译": ""
+                }
+                section = "原文"
+                continue
+
+            if not current:
+                continue
+
+            if is_jieyao(line):
+                section = "梅自强解要"
+                continue
+
+            if is_zhiyi(line):
+                section = "廖冬晴直译"
+                continue
+
+            current[section] += line + "\n"
+
+    # 最后一篇
+    if current:
+        data.append(current)
+    return data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR 识别 pages/ 下的页面图片并按篇整理为 JSON")
+    parser.add_argument("--pages", default="pages", help="页面图片目录，按文件名排序即页码顺序")
+    parser.add_argument("--output", default="huangdi_waijing.json")
+    parser.add_argument("--cache-dir", default="output/ocr_cache", help="逐页识别结果缓存目录")
+    parser.add_argument("--workers", type=int, default=4, help="OCR 进程数，每个进程加载一份模型")
+    parser.add_argument("--batch-size", type=int, default=8, help="每批交给一个进程的页数")
+    args = parser.parse_args()
+
+    img_files = sorted(os.listdir(args.pages))
+    img_paths = [os.path.join(args.pages, img) for img in img_files]
+    data = parse_pages(ocr_pages(img_paths, args.cache_dir, args.workers, args.batch_size))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 完成，共识别 {len(data)} 篇")
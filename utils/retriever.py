@@ -0,0 +1,60 @@
+from collections import defaultdict
+from langchain_core.documents import Document
+
+class MultiIndexRetriever:
+    """多索引融合检索器：每次查询只嵌入一次，在原文/直译/解要三个 FAISS 索引上
+    用同一个查询向量检索，再按权重做 RRF（Reciprocal Rank Fusion）融合。
+
+    与 EnsembleRetriever 的融合结果一致，但嵌入调用次数从 len(stores) 次降为 1 次。
+    """
+
+    def __init__(self, stores: list, weights: list[float], embed, k: int = 3, c: int = 60):
+        if len(stores) != len(weights):
+            raise ValueError("索引数量与权重数量不一致")
+        self.stores = stores
+        self.weights = weights
+        self.embed = embed
+        self.k = k
+        self.c = c
+
+    def _fuse(self, doc_lists: list[list[Document]]) -> list[tuple[Document, float]]:
+        # 以文本内容去重，同一片段在多个索引中命中时分数累加
+        rrf_score = defaultdict(float)
+        unique_docs = {}
+        for doc_list, weight in zip(doc_lists, self.weights):
+            for rank, doc in enumerate(doc_list, start=1):
+                rrf_score[doc.page_content] += weight / (rank + self.c)
+                unique_docs.setdefault(doc.page_content, doc)
+
+        return sorted(
+            ((doc, rrf_score[key]) for key, doc in unique_docs.items()),
+            key=lambda item: item[1],
+            reverse=True
+        )
+
+    def search_by_vector(self, vector: list[float]) -> list[tuple[Document, float]]:
+        return [(doc, rrf) for doc, rrf, _ in self.search_with_relevance(vector)]
+
+    def search_with_relevance(self, vector: list[float]) -> list[tuple[Document, float, float]]:
+        """返回 (文档, RRF 分数, 相关度)。RRF 只反映排名，相关度为该片段在各索引中的最大余弦相似度，
+        可作为判断检索结果是否相关的绝对分数。嵌入向量已归一化，FAISS 返回的 L2 距离平方 d 满足 cos = 1 - d / 2。
+        """
+        doc_lists, relevance = [], {}
+        for store in self.stores:
+            pairs = store.similarity_search_with_score_by_vector(vector, k=self.k)
+            doc_lists.append([doc for doc, _ in pairs])
+            for doc, distance in pairs:
+                cos = 1 - float(distance) / 2
+                relevance[doc.page_content] = max(cos, relevance.get(doc.page_content, -1.0))
+        return [(doc, rrf, relevance[doc.page_content]) for doc, rrf in self._fuse(doc_lists)]
+
+    def invoke(self, query: str) -> list[Document]:
+        vector = self.embed.embed_query(query)
+        return [doc for doc, _ in self.search_by_vector(vector)]
+
+    def invoke_with_relevance(self, query: str) -> list[tuple[Document, float, float]]:
+        return self.search_with_relevance(self.embed.embed_query(query))
+
+    async def ainvoke(self, query: str) -> list[Document]:
+        vector = await self.embed.aembed_query(query)
+        return [doc for doc, _ in self.search_by_vector(vector)]
@@ -0,0 +1,154 @@
+import re
+import json
+import uuid
+import threading
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from utils.embed_cache import normalize_text
+from utils.log import Logger
+
+logger = Logger()
+
+ROUTE_LABELS = ("retrieve", "web", "chat")
+
+# 明确指向本书的人物与书名
+DOMAIN_KEYWORDS = ("黄帝外经", "外经", "岐伯", "天师", "雷公", "鬼臾区", "广成子", "伯高", "少师")
+# 带有时效、地点、购买等意图时即使提到本书也交给 agent 判断
+WEB_HINTS = ("最新", "新闻", "今天", "明天", "最近", "现在", "哪里", "购买", "买到", "价格", "医院", "天气")
+# 多轮对话中指代上文的问题需要结合历史理解，交给 agent
+FOLLOW_UP_HINTS = ("它", "这篇", "那篇", "这段", "那段", "上面", "上文", "刚才", "前面", "继续", "还有呢", "展开")
+
+_TITLE_NOTE = re.compile(r"\[[^\]]*\]|（[^）]*）|\([^)]*\)")
+_PUNCT = re.compile(r"[\W_]+")
+
+def title_keywords(titles: list[str]) -> set[str]:
+    """由篇名生成关键词：去掉 OCR 残留的注号与“第N”，如“阴阳颠倒篇第一[1]”得到“阴阳颠倒篇”“阴阳颠倒”。
+    两三个字的篇名核心（如“呼吸”“脉动”）在日常提问中也常见，只保留带“篇”字的写法。
+    """
+    keywords = set()
+    for title in titles:
+        name = _TITLE_NOTE.sub("", title).strip()
+        core = name.split("篇", 1)[0]
+        if not core or "篇" not in name:
+            continue
+        keywords.add(f"{core}篇")
+        if len(core) >= 4:
+            keywords.add(core)
+    return keywords
+
+@dataclass
+class RouteDecision:
+    label: Optional[str]  # retrieve / web / chat，None 表示交给 agent
+    source: str           # keyword / embedding / agent
+    score: float = 0.0
+    reply: str = ""
+
+class FastRouter:
+    """agent 之前的本地快速路由，明显的问题不再调用 LLM 决定工具。
+
+    - 关键词：问题包含 82 个篇名或书中人物时直接调用 retriever_tool；与寒暄样例完全一致时直接回复
+    - 向量：与带标签样例的最大余弦相似度 >= threshold，且领先第二名 margin 以上时采用该标签
+    - 其余情况（含“记住”、指代上文的追问、书名与联网意图同时出现）交给 agent
+    - setup() 未执行或样例嵌入失败时只做关键词匹配
+    """
+
+    def __init__(self, titles: list[str], examples: list[dict], embed: Embeddings = None,
+                 threshold: float = 0.8, margin: float = 0.05):
+        self.keywords = title_keywords(titles) | set(DOMAIN_KEYWORDS)
+        self.examples = [e for e in examples if e.get("label") in ROUTE_LABELS]
+        self.replies = {self._key(e["text"]): e["reply"] for e in self.examples if e["label"] == "chat"}
+        self.embed = embed
+        self.threshold = threshold
+        self.margin = margin
+        self.vectors: Optional[np.ndarray] = None
+        self.labels: list[str] = []
+
+        self.lock = threading.Lock()
+        self.counts = {"total": 0, "keyword": 0, "embedding": 0, "agent": 0}
+
+    @classmethod
+    def from_files(cls, titles_path: str, examples_path: str, embed: Embeddings = None, **kwargs) -> "FastRouter":
+        with open(titles_path, "r", encoding="utf-8") as f:
+            titles = [item["篇名"] for item in json.load(f) if item.get("篇名")]
+        with open(examples_path, "r", encoding="utf-8") as f:
+            examples = json.load(f)
+        return cls(titles, examples, embed, **kwargs)
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return _PUNCT.sub("", normalize_text(text).lower())
+
+    async def setup(self):
+        """嵌入带标签样例，查询嵌入与检索共用 CachedEmbeddings，路由到检索时不会重复请求嵌入接口"""
+        if self.embed is None or not self.examples:
+            return
+        try:
+            vectors = np.asarray(await self.embed.aembed_documents([e["text"] for e in self.examples]), dtype="float32")
+            self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            self.labels = [e["label"] for e in self.examples]
+            logger.info(f"快速路由样例嵌入完成: {len(self.labels)} 条")
+        except Exception as e:
+            logger.error(f"快速路由样例嵌入失败，仅使用关键词匹配: {e}")
+            self.vectors = None
+
+    def match_keywords(self, question: str) -> Optional[RouteDecision]:
+        reply = self.replies.get(self._key(question))
+        if reply:
+            return RouteDecision("chat", "keyword", 1.0, reply)
+        if any(k in question for k in self.keywords):
+            if any(h in question for h in WEB_HINTS):
+                return RouteDecision(None, "agent")
+            return RouteDecision("retrieve", "keyword", 1.0)
+        return None
+
+    async def classify(self, question: str) -> Optional[RouteDecision]:
+        if self.vectors is None:
+            return None
+        vector = np.asarray(await self.embed.aembed_query(question), dtype="float32")
+        sims = self.vectors @ (vector / np.linalg.norm(vector))
+
+        best = {}
+        for label, sim in zip(self.labels, sims):
+            best[label] = max(best.get(label, -1.0), float(sim))
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        label, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        if score < self.threshold or score - runner_up < self.margin:
+            return None
+
+        reply = ""
+        if label == "chat":
+            nearest = max((i for i, l in enumerate(self.labels) if l == "chat"), key=lambda i: sims[i])
+            reply = self.examples[nearest]["reply"]
+        return RouteDecision(label, "embedding", score, reply)
+
+    async def route(self, question: str, has_history: bool = False) -> RouteDecision:
+        decision = None
+        if "记住" in question or (has_history and any(h in question for h in FOLLOW_UP_HINTS)):
+            decision = RouteDecision(None, "agent")
+        if decision is None:
+            decision = self.match_keywords(question)
+        if decision is None:
+            try:
+                decision = await self.classify(question)
+            except Exception as e:
+                logger.error(f"快速路由向量分类失败: {e}")
+        decision = decision or RouteDecision(None, "agent")
+
+        with self.lock:
+            self.counts["total"] += 1
+            self.counts[decision.source] += 1
+        logger.info(f"快速路由: {decision.label or '交给agent'}，来源 {decision.source}，分数 {decision.score:.4f}")
+        return decision
+
+    def stats(self) -> dict:
+        with self.lock:
+            counts = dict(self.counts)
+        saved = counts["keyword"] + counts["embedding"]
+        return {**counts, "llm_saved": saved, "saved_rate": round(saved / counts["total"], 4) if counts["total"] else 0.0}
+
+def tool_call(name: str, query: str) -> dict:
+    """构造与 LLM 输出格式一致的工具调用"""
+    return {"name": name, "args": {"query": query}, "id": f"call_{uuid.uuid4().hex}", "type": "tool_call"}
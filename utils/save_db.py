@@ -1,11 +1,21 @@
 # agent/vector_db.py  （建议新建一个文件专门管理向量库）
 
-import uuid
 import os
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import faiss
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from tenacity import retry, stop_after_attempt, wait_exponential
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from ..config import Config
+from config import Config
+from utils.index_store import export_compact
+from utils.index_factory import INDEX_TYPES, build_store
 import json
 
 splitter = RecursiveCharacterTextSplitter(
@@ -14,6 +24,21 @@ splitter = RecursiveCharacterTextSplitter(
     chunk_overlap=120,
 )
 
+# 三个索引对应的字段，子文件夹名 -> (字段名, 中文名)
+FIELDS = {
+    "raw": ("原文", "原文"),
+    "trans": ("廖冬晴直译", "直译"),
+    "note": ("梅自强解要", "解要"),
+}
+
+def chunk_id(title: str, field: str, seg: int, text: str) -> str:
+    """由 篇名/字段/段号/文本 计算内容寻址的分块 ID，内容不变则 ID 不变，可用于增量对比"""
+    key = "\x1f".join([title, field, str(seg), text])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def record_hash(record: dict, field: str) -> str:
+    return hashlib.sha256((record.get(field) or "").strip().encode("utf-8")).hexdigest()
+
 def field_to_docs(record: dict, field: str):
     title = record.get("篇名", "")
     text = (record.get(field) or "").strip()
@@ -26,7 +51,7 @@ def field_to_docs(record: dict, field: str):
         docs.append(Document(
             page_content=chunk,
             metadata={
-                "id": str(uuid.uuid4()),
+                "id": chunk_id(title, field, i, chunk),
                 "篇名": title,
                 "字段": field,
                 "段号": i
@@ -34,39 +59,268 @@ def field_to_docs(record: dict, field: str):
         ))
     return docs
 
-def build_and_save_db(records: list[dict], db_path: str = "faiss_db"):
+class RateLimiter:
+    """令牌桶限流，按每秒请求数控制对嵌入服务的调用频率，多线程共享"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+class BatchCheckpoint:
+    """按批次持久化已完成的嵌入结果，中断后重新运行可从断点继续。
+
+    批次以 (模型名, 批内文本) 的哈希命名，语料变化后旧批次自然失效。
+    """
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.model = model
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, texts: list[str]) -> str:
+        digest = hashlib.sha256(self.model.encode("utf-8"))
+        for text in texts:
+            digest.update(b"\x00" + text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def load(self, key: str):
+        file = os.path.join(self.path, f"{key}.npy")
+        return np.load(file) if os.path.exists(file) else None
+
+    def save(self, key: str, vectors: list[list[float]]):
+        # 先写临时文件再改名，避免中断时留下残缺批次
+        tmp = os.path.join(self.path, f"{key}.tmp.npy")
+        np.save(tmp, np.asarray(vectors, dtype=np.float32))
+        os.replace(tmp, os.path.join(self.path, f"{key}.npy"))
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def embed_all(jobs: dict, embed, batch_size: int, workers: int, rate: float, checkpoint: BatchCheckpoint) -> dict:
+    """并发嵌入多个字段的全部文档，返回 {索引名: 向量数组}"""
+    limiter = RateLimiter(rate)
+
+    @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=2, max=30), reraise=True)
+    def _embed_batch(texts: list[str]) -> list[list[float]]:
+        limiter.acquire()
+        return embed.embed_documents(texts)
+
+    def _run(name: str, start: int, texts: list[str]):
+        key = checkpoint.key(texts)
+        vectors = checkpoint.load(key)
+        if vectors is not None:
+            return name, start, vectors, True
+        vectors = np.asarray(_embed_batch(texts), dtype=np.float32)
+        checkpoint.save(key, vectors)
+        return name, start, vectors, False
+
+    results = {name: [None] * len(docs) for name, docs in jobs.items()}
+    total = sum(len(docs) for docs in jobs.values())
+    done, resumed = 0, 0
+    started = time.perf_counter()
+
+    # 三个字段的批次放进同一个线程池，互相穿插执行
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_run, name, start, [d.page_content for d in docs[start:start + batch_size]])
+            for name, docs in jobs.items()
+            for start in range(0, len(docs), batch_size)
+        ]
+        for future in as_completed(futures):
+            name, start, vectors, from_checkpoint = future.result()
+            results[name][start:start + len(vectors)] = list(vectors)
+            done += len(vectors)
+            if from_checkpoint:
+                resumed += len(vectors)
+            elapsed = time.perf_counter() - started
+            print(f"\r嵌入进度 {done}/{total}，断点恢复 {resumed} 条，{(done - resumed) / elapsed:.1f} chunks/sec", end="", flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n嵌入完成，共 {total} 条（新嵌入 {total - resumed} 条），耗时 {elapsed:.1f}s，"
+          f"平均 {(total - resumed) / elapsed if elapsed else 0:.1f} chunks/sec")
+    return {name: np.vstack(vectors) for name, vectors in results.items() if vectors}
+
+def save_index_atomic(index: FAISS, path: str):
+    """先保存到临时目录再整体替换，避免读取方看到写了一半的索引。
+
+    index.faiss/index.pkl 供增量更新读取，紧凑格式供服务端 mmap 加载。
+    """
+    tmp_path, old_path = f"{path}.tmp", f"{path}.old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    index.save_local(tmp_path)
+    export_compact(index, tmp_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def load_manifest(db_path: str) -> dict:
+    """manifest 记录每个索引中各篇的文本哈希，用于判断哪些篇发生了变化"""
+    file = os.path.join(db_path, "manifest.json")
+    if not os.path.exists(file):
+        return {}
+    with open(file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(records: list[dict], db_path: str):
+    manifest = {
+        name: {r.get("篇名", ""): record_hash(r, field) for r in records}
+        for name, (field, _) in FIELDS.items()
+    }
+    tmp = os.path.join(db_path, "manifest.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(db_path, "manifest.json"))
+
+def build_and_save_db(records: list[dict], db_path: str = "faiss_db", embed=None, batch_size: int = None,
+                      workers: int = None, rate: float = None, index_type: str = None):
     """
     一次性构建并保存三个独立的 FAISS 索引到本地文件夹
     db_path 下会生成三个子文件夹：raw / trans / note
+
+    三个字段的文档按 batch_size 分批、workers 个线程并发嵌入，rate 为每秒最大请求数；
+    已完成的批次保存在 db_path/.checkpoint，中断后重新运行会跳过这些批次。
+    index_type 可选 flat / hnsw / ivfpq / sq8，默认取 Config.FAISS_INDEX_TYPE。
     """
+    index_type = index_type or Config.FAISS_INDEX_TYPE
+    embed = embed or Config.embed1
+    batch_size = batch_size or Config.EMBED_BATCH_SIZE
+    workers = workers or Config.EMBED_WORKERS
+    rate = Config.EMBED_RATE_LIMIT if rate is None else rate
     os.makedirs(db_path, exist_ok=True)
-    
-    raw_docs, trans_docs, note_docs = [], [], []
 
-    for r in records:
-        raw_docs.extend(field_to_docs(r, "原文"))
-        trans_docs.extend(field_to_docs(r, "廖冬晴直译"))
-        note_docs.extend(field_to_docs(r, "梅自强解要"))
+    jobs = {}
+    for name, (field, _) in FIELDS.items():
+        docs = []
+        for r in records:
+            docs.extend(field_to_docs(r, field))
+        if docs:
+            jobs[name] = docs
+
+    checkpoint = BatchCheckpoint(os.path.join(db_path, ".checkpoint"), getattr(embed, "model", embed.__class__.__name__))
+    vectors = embed_all(jobs, embed, batch_size, workers, rate, checkpoint)
 
     # 构建并保存
-    if raw_docs:
-        raw_index = FAISS.from_documents(raw_docs, Config.embed1)
-        raw_index.save_local(os.path.join(db_path, "raw"))
-        print(f"原文索引保存完成，共 {len(raw_docs)} 条向量")
-    
-    if trans_docs:
-        trans_index = FAISS.from_documents(trans_docs, Config.embed1)
-        trans_index.save_local(os.path.join(db_path, "trans"))
-        print(f"直译索引保存完成，共 {len(trans_docs)} 条向量")
-    
-    if note_docs:
-        note_index = FAISS.from_documents(note_docs, Config.embed1)
-        note_index.save_local(os.path.join(db_path, "note"))
-        print(f"解要索引保存完成，共 {len(note_docs)} 条向量")
+    for name, docs in jobs.items():
+        index = build_store(docs, vectors[name], embed, index_type)
+        save_index_atomic(index, os.path.join(db_path, name))
+        print(f"{FIELDS[name][1]}索引保存完成，共 {len(docs)} 条向量，类型 {index_type}")
 
+    # 全部索引保存成功后才写 manifest 并清理断点
+    save_manifest(records, db_path)
+    checkpoint.clear()
     print(f"所有向量数据库已保存至：{db_path}")
 
+def update_db(records: list[dict], db_path: str = "faiss_db", embed=None, batch_size: int = None,
+              workers: int = None, rate: float = None):
+    """
+    增量更新已有的三个 FAISS 索引：只对发生变化的篇重新分块，只嵌入新增或修改的分块，
+    用 FAISS.delete 删除过期向量，最后原子替换索引目录。
+
+    没有 manifest 的旧索引会把所有篇视为已变化，但仍按分块内容 ID 对比，未变化的分块不会重新嵌入。
+    """
+    embed = embed or Config.embed1
+    batch_size = batch_size or Config.EMBED_BATCH_SIZE
+    workers = workers or Config.EMBED_WORKERS
+    rate = Config.EMBED_RATE_LIMIT if rate is None else rate
+    manifest = load_manifest(db_path)
+    titles = {r.get("篇名", "") for r in records}
+
+    indexes, jobs, stale = {}, {}, {}
+    for name, (field, _) in FIELDS.items():
+        path = os.path.join(db_path, name)
+        if not os.path.exists(path):
+            print(f"{FIELDS[name][1]}索引不存在，请先执行完整构建")
+            continue
+        index = FAISS.load_local(path, embed, allow_dangerous_deserialization=True)
+
+        # 现有分块：内容 ID -> docstore ID，兼容旧版随机 ID 的索引
+        existing = {}
+        for docstore_id, doc in index.docstore._dict.items():
+            meta = doc.metadata
+            cid = chunk_id(meta.get("篇名", ""), meta.get("字段", field), meta.get("段号", 0), doc.page_content)
+            existing[cid] = (docstore_id, meta.get("篇名", ""))
+
+        hashes = manifest.get(name, {})
+        changed = [r for r in records if hashes.get(r.get("篇名", "")) != record_hash(r, field)]
+        changed_titles = {r.get("篇名", "") for r in changed}
+
+        new_docs = {}
+        for r in changed:
+            for doc in field_to_docs(r, field):
+                new_docs[doc.metadata["id"]] = doc
+
+        # 变化的篇中不再出现的分块，以及已被移除的篇的全部分块
+        stale[name] = [
+            docstore_id for cid, (docstore_id, title) in existing.items()
+            if (title in changed_titles and cid not in new_docs) or title not in titles
+        ]
+        to_add = [doc for cid, doc in new_docs.items() if cid not in existing]
+        if to_add:
+            jobs[name] = to_add
+        indexes[name] = index
+        print(f"{FIELDS[name][1]}：变化 {len(changed)} 篇，新增 {len(to_add)} 块，删除 {len(stale[name])} 块")
+
+    if not any(jobs.values()) and not any(stale.values()):
+        print("索引已是最新，无需更新")
+        save_manifest(records, db_path)
+        return
+
+    # 在调用嵌入接口、修改任何索引之前检查，避免部分索引已更新后才失败
+    for name, index in indexes.items():
+        if stale[name] and isinstance(index.index, faiss.IndexHNSW):
+            raise ValueError(f"{FIELDS[name][1]}索引为 HNSW，不支持删除向量，请使用 --mode build 全量重建")
+
+    checkpoint = BatchCheckpoint(os.path.join(db_path, ".checkpoint"), getattr(embed, "model", embed.__class__.__name__))
+    vectors = embed_all(jobs, embed, batch_size, workers, rate, checkpoint) if jobs else {}
+
+    for name, index in indexes.items():
+        if not stale[name] and name not in jobs:
+            continue
+        if stale[name]:
+            index.delete(stale[name])
+        if name in jobs:
+            docs = jobs[name]
+            index.add_embeddings(
+                text_embeddings=[(d.page_content, v.tolist()) for d, v in zip(docs, vectors[name])],
+                metadatas=[d.metadata for d in docs],
+                ids=[d.metadata["id"] for d in docs]
+            )
+        save_index_atomic(index, os.path.join(db_path, name))
+        print(f"{FIELDS[name][1]}索引更新完成，当前共 {index.index.ntotal} 条向量")
+
+    save_manifest(records, db_path)
+    checkpoint.clear()
+    print(f"向量数据库增量更新完成：{db_path}")
+
 if __name__ == "__main__":
-    with open("data/huangdi_waijing.json", "r", encoding="utf-8") as f:
+    # 在项目根目录执行：python -m utils.save_db --data data/hdwj.json
+    parser = argparse.ArgumentParser(description="构建《黄帝外经》FAISS 向量数据库")
+    parser.add_argument("--data", default="data/hdwj.json", help="pdf2json 生成的 json 数据")
+    parser.add_argument("--mode", choices=["build", "update"], default="build", help="build 全量重建，update 增量更新")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=Config.FAISS_INDEX_TYPE, help="全量构建时使用的索引类型")
+    parser.add_argument("--db-path", default="faiss_db")
+    parser.add_argument("--batch-size", type=int, default=Config.EMBED_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=Config.EMBED_WORKERS)
+    parser.add_argument("--rate", type=float, default=Config.EMBED_RATE_LIMIT, help="每秒最大请求数，0 表示不限流")
+    args = parser.parse_args()
+
+    with open(args.data, "r", encoding="utf-8") as f:
         records = json.load(f)
-    build_and_save_db(records, db_path="faiss_db")
\ No newline at end of file
+    if args.mode == "update":
+        update_db(records, db_path=args.db_path, batch_size=args.batch_size, workers=args.workers, rate=args.rate)
+    else:
+        build_and_save_db(records, db_path=args.db_path, batch_size=args.batch_size, workers=args.workers,
+                          rate=args.rate, index_type=args.index_type)
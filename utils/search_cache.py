@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import threading
+from typing import Callable, Optional
+from psycopg_pool import AsyncConnectionPool
+from utils.embed_cache import normalize_text
+from utils.tool_executor import detach, get_tool_executor
+from utils.metrics import WEB_SEARCH_CACHE
+from utils.log import Logger
+
+logger = Logger()
+
+class SearchCache:
+    """联网搜索结果缓存。
+
+    - 以规范化后的查询为键，结果存入 Postgres 的 web_search_cache 表，多个 API worker 共享，超过 ttl 秒视为过期
+    - 同一进程内相同查询并发到达时只发起一次上游搜索，其余请求等待同一结果（single-flight）
+    - 未调用 setup() 或建表失败时只做进程内合并，不做持久化
+    """
+
+    def __init__(self, ttl: int = 6 * 3600):
+        self.ttl = ttl
+        self.conn_pool: Optional[AsyncConnectionPool] = None
+        self.inflight: dict[str, asyncio.Task] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def setup(self, conn_pool: AsyncConnectionPool):
+        async with conn_pool.connection() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS web_search_cache (
+                    query_key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+        self.conn_pool = conn_pool
+
+    @staticmethod
+    def key(query: str) -> str:
+        return hashlib.sha256(normalize_text(query).lower().encode("utf-8")).hexdigest()
+
+    def _count(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+        WEB_SEARCH_CACHE.labels(result=name).inc()
+
+    async def _lookup(self, key: str) -> Optional[str]:
+        if self.conn_pool is None:
+            return None
+        try:
+            async with self.conn_pool.connection() as conn:
+                cur = await conn.execute(
+                    "SELECT result FROM web_search_cache WHERE query_key = %s AND created_at > now() - make_interval(secs => %s)",
+                    (key, self.ttl)
+                )
+                row = await cur.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"查询搜索缓存时发生错误: {e}")
+            return None
+
+    async def _store(self, key: str, query: str, result: str):
+        if self.conn_pool is None:
+            return
+        try:
+            async with self.conn_pool.connection() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO web_search_cache (query_key, query, result) VALUES (%s, %s, %s)
+                    ON CONFLICT (query_key) DO UPDATE SET query = EXCLUDED.query, result = EXCLUDED.result, created_at = now()
+                    """,
+                    (key, query, result)
+                )
+        except Exception as e:
+            logger.error(f"写入搜索缓存时发生错误: {e}")
+
+    async def _fetch(self, key: str, query: str, fetch: Callable[[], Optional[str]]) -> Optional[str]:
+        try:
+            result = await self._lookup(key)
+            if result is not None:
+                self._count("hits")
+                logger.info(f"搜索缓存命中: {query}")
+                return result
+
+            self._count("misses")
+            # 在工具执行器的线程池中搜索；本任务由 detach 创建，结束前一直占用发起搜索的工具的并发名额
+            result = await get_tool_executor().run_blocking(fetch)
+            # 空结果与异常不缓存，下次重新搜索
+            if result:
+                await self._store(key, query, result)
+            return result
+        finally:
+            self.inflight.pop(key, None)
+
+    async def get_or_fetch(self, query: str, fetch: Callable[[], Optional[str]]) -> Optional[str]:
+        """返回缓存结果，未命中时调用 fetch（同步函数，在工具执行器的线程中执行）获取并写入缓存"""
+        key = self.key(query)
+        task = self.inflight.get(key)
+        if task is None:
+            # 上游搜索放在独立任务中，发起请求的一方超时或被取消不影响其他等待者
+            task = detach(self._fetch(key, query, fetch))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.inflight[key] = task
+        else:
+            self._count("coalesced")
+            logger.info(f"合并相同的并发搜索: {query}")
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
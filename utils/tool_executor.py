@@ -0,0 +1,224 @@
+import time
+import asyncio
+import threading
+import contextvars
+from collections import defaultdict
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from langchain_core.messages import ToolMessage
+from config import Config
+from utils.metrics import TOOL_LATENCY, span
+from utils.log import Logger
+
+logger = Logger()
+
+class _Slot:
+    """原生异步工具占用的并发名额：工具结束后，经 run_blocking 启动的线程与 detach 交出的任务全部结束才归还"""
+
+    def __init__(self, executor: "ToolExecutor", name: str, semaphore: asyncio.Semaphore):
+        self.executor = executor
+        self.name = name
+        self.semaphore = semaphore
+        self.loop = asyncio.get_running_loop()
+        self.pending = 0
+        self.closed = False
+        self.released = False
+
+    def hold(self, future):
+        # 名额已归还后不再计入，避免同一名额被归还两次
+        if self.released:
+            return
+        self.pending += 1
+
+        def _done(_):
+            try:
+                self.loop.call_soon_threadsafe(self._finish)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+        future.add_done_callback(_done)
+
+    def _release_if_idle(self):
+        if self.closed and not self.pending and not self.released:
+            self.released = True
+            self.executor._release(self.name, self.semaphore)
+
+    def _finish(self):
+        self.pending -= 1
+        self._release_if_idle()
+
+    def close(self):
+        self.closed = True
+        self._release_if_idle()
+
+# 当前原生异步工具的名额，run_blocking 与 detach 据此把线程、任务计入该工具的并发上限
+_current_slot: ContextVar[Optional[_Slot]] = ContextVar("tool_slot", default=None)
+
+def detach(coro) -> asyncio.Task:
+    """把工作交给独立任务（调用方可 shield 等待）：任务创建时即计入当前工具的名额，调用方超时或被取消后
+    名额保持到任务结束；任务本身不继承该名额，其中的 run_blocking 不再重复计入"""
+    slot = _current_slot.get()
+    context = contextvars.copy_context()
+    context.run(_current_slot.set, None)
+    task = asyncio.get_running_loop().create_task(coro, context=context)
+    if slot is not None:
+        slot.hold(task)
+    return task
+
+class ToolExecutor:
+    """进程级共享的工具执行器。
+
+    - 同步工具在常驻线程池中执行，原生异步工具直接在事件循环中 await，同一步的多个调用用 asyncio.gather 并发
+    - 每个工具有独立的并发上限，网络搜索变慢不会占满 FAISS 检索的名额
+    - 每次调用有超时；同步工具超时后线程仍会跑完，名额在线程真正结束时才归还，避免堆积失控线程；
+      原生异步工具内的阻塞调用经 run_blocking 执行，同样在线程结束时才归还名额
+    - stats() 返回各工具的排队数、执行数、完成数、超时数与错误数
+    """
+
+    def __init__(self, max_workers: int = 16, limits: dict = None, default_limit: int = 4,
+                 timeouts: dict = None, default_timeout: float = 30):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: {"waiting": 0, "running": 0, "completed": 0, "timeouts": 0, "errors": 0})
+
+    def _semaphore(self, name: str) -> asyncio.Semaphore:
+        if name not in self.semaphores:
+            self.semaphores[name] = asyncio.Semaphore(self.limits.get(name, self.default_limit))
+        return self.semaphores[name]
+
+    def _count(self, name: str, key: str, delta: int = 1):
+        with self.lock:
+            self.counters[name][key] += delta
+
+    def _release(self, name: str, semaphore: asyncio.Semaphore):
+        self._count(name, "running", -1)
+        semaphore.release()
+
+    async def _acquire(self, name: str) -> asyncio.Semaphore:
+        semaphore = self._semaphore(name)
+        self._count(name, "waiting")
+        try:
+            await semaphore.acquire()
+        finally:
+            self._count(name, "waiting", -1)
+        self._count(name, "running")
+        return semaphore
+
+    async def _run_async(self, tool, tool_call: dict):
+        semaphore = await self._acquire(tool.name)
+        slot = _Slot(self, tool.name, semaphore)
+        token = _current_slot.set(slot)
+        try:
+            return await tool.ainvoke(tool_call)
+        finally:
+            _current_slot.reset(token)
+            slot.close()
+
+    async def run_blocking(self, fn, *args):
+        """在常驻线程池中执行原生异步工具内的阻塞调用；工具超时被取消后，名额保持到线程结束"""
+        future = self.pool.submit(contextvars.copy_context().run, fn, *args)
+        slot = _current_slot.get()
+        if slot is not None:
+            slot.hold(future)
+        return await asyncio.wrap_future(future)
+
+    async def _run_in_thread(self, tool, tool_call: dict):
+        semaphore = await self._acquire(tool.name)
+        loop = asyncio.get_running_loop()
+        try:
+            # 复制上下文，请求固定的索引版本等 ContextVar 在工具线程中同样可见
+            future = self.pool.submit(contextvars.copy_context().run, tool.invoke, tool_call)
+        except BaseException:
+            self._release(tool.name, semaphore)
+            raise
+
+        def _done(_):
+            try:
+                loop.call_soon_threadsafe(self._release, tool.name, semaphore)
+            except RuntimeError:
+                # 事件循环已关闭
+                self._count(tool.name, "running", -1)
+
+        future.add_done_callback(_done)
+        return await asyncio.wrap_future(future)
+
+    async def ainvoke(self, tool, tool_call: dict) -> ToolMessage:
+        """执行单个工具调用，超时或出错时返回错误信息的 ToolMessage，不向上抛出"""
+        name = tool_call["name"]
+        timeout = self.timeouts.get(name, self.default_timeout)
+        call = {"type": "tool_call", "name": name, "args": tool_call["args"], "id": tool_call["id"]}
+        run = self._run_async if getattr(tool, "coroutine", None) else self._run_in_thread
+        # 被取消时不会进入下面的 except 分支
+        status = "cancelled"
+        started = time.perf_counter()
+
+        try:
+            with span(f"tool.{name}", tool=name):
+                result = await asyncio.wait_for(run(tool, call), timeout)
+            status = "ok"
+            self._count(name, "completed")
+            if isinstance(result, ToolMessage):
+                return result
+            return ToolMessage(content=str(result), tool_call_id=tool_call["id"], name=name)
+
+        except asyncio.TimeoutError:
+            status = "timeout"
+            self._count(name, "timeouts")
+            logger.error(f"工具 {name} 调用超时（{timeout}s）")
+            return ToolMessage(content=f"Error: 工具 {name} 调用超时", tool_call_id=tool_call["id"], name=name, status="error")
+
+        except Exception as e:
+            status = "error"
+            self._count(name, "errors")
+            logger.error(f"调用工具时发生错误: {e}")
+            return ToolMessage(content=f"Error: {e}", tool_call_id=tool_call["id"], name=name, status="error")
+
+        finally:
+            TOOL_LATENCY.labels(tool=name, status=status).observe(time.perf_counter() - started)
+
+    async def ainvoke_all(self, tool_map: dict, tool_calls: list[dict]) -> list[ToolMessage]:
+        """并发执行一批工具调用，结果顺序与 tool_calls 一致"""
+        async def _one(tool_call: dict) -> ToolMessage:
+            tool = tool_map.get(tool_call["name"])
+            if tool is None:
+                logger.error(f"Tool '{tool_call['name']}' not found")
+                return ToolMessage(content=f"Error: Tool '{tool_call['name']}' not found",
+                                   tool_call_id=tool_call["id"], name=tool_call.get("name", "unknown"), status="error")
+            return await self.ainvoke(tool, tool_call)
+
+        return list(await asyncio.gather(*(_one(call) for call in tool_calls)))
+
+    def stats(self) -> dict:
+        with self.lock:
+            tools = {name: dict(counter) for name, counter in self.counters.items()}
+        return {
+            "tools": tools,
+            "queue_depth": sum(counter["waiting"] for counter in tools.values()),
+            "pool_backlog": self.pool._work_queue.qsize(),
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+_executor: Optional[ToolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_tool_executor() -> ToolExecutor:
+    """返回进程内唯一的工具执行器，首次调用时按 Config 创建"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ToolExecutor(
+                max_workers=Config.TOOL_EXECUTOR_WORKERS,
+                limits=Config.TOOL_CONCURRENCY,
+                timeouts=Config.TOOL_TIMEOUTS,
+                default_timeout=Config.TOOL_DEFAULT_TIMEOUT
+            )
+        return _executor
@@ -0,0 +1,154 @@
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Optional
+from langgraph.store.base import BaseStore, PutOp
+from utils.metrics import DB_LATENCY, observe
+from utils.log import Logger
+
+logger = Logger()
+
+class UserProfileCache:
+    """用户长期记忆画像缓存。
+
+    - 画像为该用户最近的 limit 条记忆，按更新时间列出，不带 query，不调用嵌入接口
+    - 画像按用户缓存在进程内（LRU + TTL），同一请求中重写后再次进入 agent 不再查库
+    - “记住”写入先进入待写列表并使该用户的画像失效，由后台任务攒批后一次 abatch 提交，
+      写入期间待写内容已出现在画像中；多个 API worker 之间的画像最多滞后 ttl 秒
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, limit: int = 10,
+                 batch_size: int = 32, flush_interval: float = 0.5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.limit = limit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.store: Optional[BaseStore] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        # 尚未提交的记忆与每个用户的版本号，版本号变化后正在进行的查询结果不再写入缓存
+        self.pending = defaultdict(list)
+        self.versions = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.batches = 0
+        self.failed = 0
+
+    async def setup(self, store: BaseStore):
+        self.store = store
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._writer())
+
+    @staticmethod
+    def namespace(user_id: str) -> tuple[str, str]:
+        return ("memories", user_id)
+
+    def _render(self, user_id: str, memories: list[str]) -> str:
+        pending = [text for _, text in reversed(self.pending.get(user_id, []))]
+        return "\n".join((pending + memories)[:self.limit])
+
+    async def get(self, user_id: str) -> str:
+        with self.lock:
+            entry = self.cache.get(user_id)
+            if entry and entry[1] > time.monotonic():
+                self.cache.move_to_end(user_id)
+                self.hits += 1
+                return self._render(user_id, entry[0])
+            self.misses += 1
+            version = self.versions[user_id]
+
+        items = await self.store.asearch(self.namespace(user_id), limit=self.limit)
+        memories = [item.value["data"] for item in items]
+
+        with self.lock:
+            if self.versions[user_id] == version:
+                self.cache[user_id] = (memories, time.monotonic() + self.ttl)
+                self.cache.move_to_end(user_id)
+                while len(self.cache) > self.maxsize:
+                    self.cache.popitem(last=False)
+            return self._render(user_id, memories)
+
+    def _invalidate(self, user_id: str):
+        self.cache.pop(user_id, None)
+        self.versions[user_id] += 1
+
+    def remember(self, user_id: str, text: str):
+        """加入后台写入队列，立即返回"""
+        key = str(uuid.uuid4())
+        with self.lock:
+            self.pending[user_id].append((key, text))
+            self._invalidate(user_id)
+        self.queue.put_nowait((user_id, key, text))
+
+    async def _flush(self, batch: list[tuple[str, str, str]]):
+        ok = False
+        try:
+            # 一次 abatch 在同一事务中写入，并合并为一次嵌入请求；asearch 等内部也经 abatch 执行，
+            # 所以不在 instrument_db 中整体包装 abatch，只在这里单独计时
+            with observe(DB_LATENCY, "db.store.abatch", component="store", operation="abatch"):
+                await self.store.abatch([PutOp(self.namespace(user_id), key, {"data": text}) for user_id, key, text in batch])
+            ok = True
+        except Exception as e:
+            logger.error(f"写入记忆时发生错误，丢弃 {len(batch)} 条: {e}")
+        finally:
+            keys = {key for _, key, _ in batch}
+            with self.lock:
+                if ok:
+                    self.writes += len(batch)
+                    self.batches += 1
+                else:
+                    self.failed += len(batch)
+                for user_id in {user_id for user_id, _, _ in batch}:
+                    flushed = [text for key, text in self.pending[user_id] if key in keys]
+                    self.pending[user_id] = [p for p in self.pending[user_id] if p[0] not in keys]
+                    if not self.pending[user_id]:
+                        del self.pending[user_id]
+                    # 已提交的记忆直接并入缓存的画像，不必为此再查一次库
+                    self.versions[user_id] += 1
+                    entry = self.cache.get(user_id)
+                    if ok and entry:
+                        self.cache[user_id] = ((flushed[::-1] + entry[0])[:self.limit], entry[1])
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def stop(self, timeout: float = 10):
+        """提交队列中剩余的记忆后停止后台任务"""
+        if self.task:
+            self.queue.put_nowait(None)
+            done, _ = await asyncio.wait([self.task], timeout=timeout)
+            if not done:
+                logger.error(f"记忆写入队列未在 {timeout} 秒内提交完成，剩余 {self.queue.qsize()} 条")
+                self.task.cancel()
+            self.task = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {"size": len(self.cache), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                    "writes": self.writes, "batches": self.batches, "failed": self.failed,
+                    "pending": sum(len(v) for v in self.pending.values())}
@@ -22,6 +22,8 @@ stream_flag = False
 
 users_db = {}
 user_id_map = {}
+# 登录返回的会话令牌，按 user_id 保存，发送消息时放在 Authorization 头中
+session_tokens = {}
 
 def generate_unique_user_id(username):
     if username not in user_id_map:
@@ -44,6 +46,9 @@ def send_message(user_message, history, user_id, conversation_id, username):
         "userId": user_id,
         "conversationId": conversation_id
     }
+    request_headers = dict(headers)
+    if session_tokens.get(user_id):
+        request_headers["Authorization"] = f"Bearer {session_tokens[user_id]}"
 
     # 【重点修正】这里必须用列表嵌套 [[user, ai]]，不能用字典！
     # 如果 history 是 None，先初始化为空列表
@@ -67,7 +72,7 @@ def send_message(user_message, history, user_id, conversation_id, username):
     if stream_flag:
         assistant_response = ""
         try:
-            with requests.post(url, headers=headers, data=json.dumps(data), stream=True) as response:
+            with requests.post(url, headers=request_headers, data=json.dumps(data), stream=True) as response:
                 for line in response.iter_lines():
                     if line:
                         json_str = line.decode('utf-8').strip("data: ")
@@ -94,7 +99,7 @@ def send_message(user_message, history, user_id, conversation_id, username):
 
     else:
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = requests.post(url, headers=request_headers, data=json.dumps(data))
             response_json = response.json()
             assistant_content = response_json['choices'][0]['message']['content']
             formatted_content = format_response(assistant_content)
@@ -148,6 +153,7 @@ def login(username, password):
 
         data = r.json()
         user_id = data["user_id"]
+        session_tokens[user_id] = data.get("token")
 
         conversation_id = generate_unique_conversation_id(username)
         create_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")